@@ -1,15 +1,28 @@
+import os
 import numpy as np
+import pprint
 import logging
 from YRC.core import Algorithm
 from YRC.core.configs.global_configs import get_global_variable
+from YRC.algorithms.search import make_search, eval_candidates
+from YRC.policies.ood import SlicedOODPolicy
 
 
 class OODAlgorithm(Algorithm):
+    # default num_samples of each benchmark, about as many rows as the rollouts kept before reservoir sampling
+    NUM_SAMPLES = {"procgen": 1024, "cliport": 512, "minigrid": 512}
+
     def __init__(self, config, env):
         super().__init__()
         self.args = config
         self.env = env
         self.save_dir = get_global_variable("experiment_dir")
+        self.num_samples = config.num_samples or self.NUM_SAMPLES[get_global_variable("benchmark")]
+
+    @property
+    def num_eval_slices(self):
+        # with batch_candidates, the detectors of all feature types share the rollouts of each sweep step
+        return len(self.args.feature_types) if self.args.feature_types and self.args.batch_candidates else 1
 
     def train(
             self,
@@ -20,37 +33,47 @@ class OODAlgorithm(Algorithm):
             eval_splits=None,
     ):
         args = self.args
-        best_summary = {split: {"reward_mean": -1e9} for split in eval_splits}
-        best_params = {}
+        if args.feature_types:
+            return self._train_feature_types(policy, envs, evaluator, eval_splits)
 
         # Initialize OOD detector
         policy.initialize_ood_detector(args, envs["train"])
 
         # Generate rollouts for training OOD detector
-        rollout_obs = policy.gather_rollouts(envs["train"], args.num_rollouts)
-        rollout_obs_threshold = policy.gather_rollouts(envs["train"], args.num_rollouts)
+        rollout_features = policy.gather_rollouts(envs["train"], args.num_rollouts, self.num_samples)
+        rollout_features_threshold = policy.gather_rollouts(
+            envs["train"], args.num_rollouts, self.num_samples, name="threshold"
+        )
 
         # Train OOD detector
-        policy.clf.fit(rollout_obs, rollout_obs_threshold)
+        policy.fit_detector(rollout_features, rollout_features_threshold)
 
-        # Threshold search
-        thresholds_min, thresholds_max = policy.clf.decision_scores_.min(), policy.clf.decision_scores_.max()
-        if thresholds_min == thresholds_max:
-            cand_thresholds = [thresholds_min]
-        else:
-            cand_thresholds = np.linspace(thresholds_min, thresholds_max, args.num_thresholds)
-        for threshold in cand_thresholds:
-            params = {"threshold": threshold}
-            logging.info(f"Evaluating threshold: {threshold}")
+        self._search_threshold(policy, envs, evaluator, eval_splits, self.save_dir)
 
-            policy.update_params(params)
-            split_summary = evaluator.eval(policy, envs, eval_splits)
+    def _search_threshold(self, policy, envs, evaluator, eval_splits, save_dir):
+        best_summary = {split: {"reward_mean": -1e9} for split in eval_splits}
+        best_params = {}
+        cand_thresholds = self._get_cand_thresholds(policy.clf)
+
+        def eval_fn(thresholds, splits, num_episodes):
+            cand_params = [{"threshold": threshold} for threshold in thresholds]
+            return eval_candidates(policy, envs, evaluator, splits, cand_params, num_episodes, best_summary)
 
-            for split in eval_splits:
+        search = make_search(self.args)
+        for threshold, split_summary in search.run(
+                eval_fn,
+                cand_thresholds,
+                eval_splits,
+                evaluator.args.validation_episodes,
+                envs[eval_splits[0]].num_envs,
+        ):
+            params = {"threshold": threshold}
+            for split in split_summary:
                 if split_summary[split]["reward_mean"] > best_summary[split]["reward_mean"]:
                     best_params[split] = params
                     best_summary[split] = split_summary[split]
-                    policy.save_model(f"best_{split}", self.save_dir)
+                    policy.update_params(params)
+                    policy.save_model(f"best_{split}", save_dir)
 
                 # Log best result so far
                 logging.info(f"Best {split} so far")
@@ -58,3 +81,88 @@ class OODAlgorithm(Algorithm):
                 evaluator.write_summary(f"best_{split}", best_summary[split])
 
         policy.update_params(best_params[eval_splits[0]])  # Update with best params from first eval split
+
+    def _get_cand_thresholds(self, clf):
+        thresholds_min, thresholds_max = clf.decision_scores_.min(), clf.decision_scores_.max()
+        if thresholds_min == thresholds_max:
+            return [thresholds_min]
+        return np.linspace(thresholds_min, thresholds_max, self.args.num_thresholds)
+
+    def _train_feature_types(self, policy, envs, evaluator, eval_splits):
+        # NOTE: one rollout samples the keys of all feature types, each detector is fitted on its own view
+        args = self.args
+        feature_types = []
+        for feature_type in args.feature_types:
+            if policy.supports_feature_type(feature_type):
+                feature_types.append(feature_type)
+            else:
+                logging.warning(f"Skipping {feature_type} features, not supported by {policy.args.method}")
+        assert feature_types, f"None of the feature types is supported by {policy.args.method}!"
+        if args.batch_candidates:
+            assert len(feature_types) == self.num_eval_slices, "Batched sweeps need every feature type supported!"
+            assert (args.search or "grid") == "grid", "Batched sweeps need the fixed candidate sets of a grid search!"
+
+        keys = []
+        for feature_type in feature_types:
+            keys += [key for key in policy.fit_keys(feature_type) if key not in keys]
+        features = policy.gather_features(envs["train"], args.num_rollouts, self.num_samples, keys)
+        features_threshold = policy.gather_features(
+            envs["train"], args.num_rollouts, self.num_samples, keys, name="threshold"
+        )
+
+        policies = []
+        for feature_type in feature_types:
+            logging.info(f"Training OOD detector on {feature_type} features")
+            feature_policy = policy.for_feature_type(feature_type)
+            feature_policy.initialize_ood_detector(args, envs["train"])
+            feature_policy.fit_detector(features, features_threshold)
+            if not args.batch_candidates:
+                self._search_threshold(
+                    feature_policy, envs, evaluator, eval_splits, self._feature_save_dir(feature_type)
+                )
+            policies.append(feature_policy)
+
+        if args.batch_candidates:
+            self._search_thresholds_batched(policies, envs, evaluator, eval_splits)
+
+    def _feature_save_dir(self, feature_type):
+        save_dir = os.path.join(self.save_dir, feature_type)
+        os.makedirs(save_dir, exist_ok=True)
+        return save_dir
+
+    def _search_thresholds_batched(self, policies, envs, evaluator, eval_splits):
+        # NOTE: step i evaluates the i-th candidate of every detector, each on its own slice of the wide envs
+        # (see train.py), so simulation and weak-agent inference are paid once per step for all detectors
+        cand_thresholds = [self._get_cand_thresholds(policy.clf) for policy in policies]
+        save_dirs = [self._feature_save_dir(policy.feature_type) for policy in policies]
+        sliced_policy = SlicedOODPolicy(policies)
+        wide_splits = [f"{split}_wide" for split in eval_splits]
+        best_summary = [{split: {"reward_mean": -1e9} for split in eval_splits} for _ in policies]
+        best_params = [{} for _ in policies]
+
+        for i in range(max(len(thresholds) for thresholds in cand_thresholds)):
+            # detectors with fewer candidates (a single one when all scores are equal) repeat their last one,
+            # whose results are not counted again
+            for policy, thresholds in zip(policies, cand_thresholds):
+                policy.update_params({"threshold": thresholds[min(i, len(thresholds) - 1)]})
+            logging.info("Parameters: " + pprint.pformat({p.feature_type: p.params for p in policies}, indent=2))
+            wide_summary = evaluator.eval(sliced_policy, envs, wide_splits, num_slices=len(policies))
+
+            for k, (policy, thresholds) in enumerate(zip(policies, cand_thresholds)):
+                if i >= len(thresholds):
+                    continue
+                params = {"threshold": thresholds[i]}
+                for split in eval_splits:
+                    summary = wide_summary[f"{split}_wide"][k]
+                    if summary["reward_mean"] > best_summary[k][split]["reward_mean"]:
+                        best_params[k][split] = params
+                        best_summary[k][split] = summary
+                        policy.save_model(f"best_{split}", save_dirs[k])
+
+                    # Log best result so far
+                    logging.info(f"Best {split} so far ({policy.feature_type})")
+                    logging.info(f"Parameters: {best_params[k][split]}")
+                    evaluator.write_summary(f"best_{split}", best_summary[k][split])
+
+        for k, policy in enumerate(policies):
+            policy.update_params(best_params[k][eval_splits[0]])  # Update with best params from first eval split
@@ -34,7 +34,8 @@ class RandomAlgorithm(Algorithm):
             logging.info(f"Prob: {prob}")
 
             policy.update_params(prob)
-            split_summary = evaluator.eval(policy, envs, eval_splits)
+            stop_targets = {split: best_summary[split]["reward_mean"] for split in eval_splits}
+            split_summary = evaluator.eval(policy, envs, eval_splits, stop_targets=stop_targets)
 
             for split in eval_splits:
                 if (
@@ -6,29 +6,50 @@ from YRC.core.configs.global_configs import get_global_variable
 from YRC.core import Algorithm
 
 
+def compute_gae(rewards, values, dones, next_value, next_done, gamma, gae_lambda):
+    """Generalized advantage estimates of a (num_steps, num_envs) rollout.
+
+    Solves advantages[t] = delta[t] + gamma * gae_lambda * nextnonterminal[t] * advantages[t + 1] with a
+    reverse scan that doubles the span of each step, so it takes log2(num_steps) vectorized steps instead of
+    num_steps sequential ones. Results match the step-by-step recursion up to float rounding.
+    """
+    nextnonterminal = 1.0 - torch.cat([dones[1:], next_done.view(1, -1)])
+    nextvalues = torch.cat([values[1:], next_value.view(1, -1)])
+    # advantages[t] = b[t] + a[t] * advantages[t + span], with advantages[num_steps] = 0
+    b = rewards + gamma * nextvalues * nextnonterminal - values
+    a = gamma * gae_lambda * nextnonterminal
+    span = 1
+    while span < len(b):
+        b = torch.cat([b[:-span] + a[:-span] * b[span:], b[-span:]])
+        a = torch.cat([a[:-span] * a[span:], torch.zeros_like(a[-span:])])
+        span *= 2
+    return b
+
+
 class PPOAlgorithm(Algorithm):
     def __init__(self, config, env):
         self.args = config
         self.args.num_envs = env.num_envs
         self.obs_shape = env.obs_shape
         self.action_shape = env.action_shape
+        # NOTE: 8-bit frames (procgen) are stored as uint8 and scaled back by the coordination model
+        self.obs_scale = getattr(env.base_env, "obs_scale", None)
 
     def init(self, policy, envs):
         args = self.args
         args.batch_size = int(args.num_envs * args.num_steps)
         args.minibatch_size = int(args.batch_size // args.num_minibatches)
         args.num_iterations = args.total_timesteps // args.batch_size
-        self.total_reward = {
-            "reward": [0.] * args.num_envs,
-            "env_reward": [0.] * args.num_envs
-        }
 
         device = get_global_variable("device")
         # Initialize all tensors
         if isinstance(self.obs_shape, dict):
+            # NOTE: only the keys read by the coordination model are stored, CoordEnv always returns env_obs
+            self.obs_shape = {k: shape for k, shape in self.obs_shape.items() if k in policy.model.obs_keys}
             self.obs = {}
             for k, shape in self.obs_shape.items():
-                self.obs[k] = torch.zeros((args.num_steps, args.num_envs) + shape).to(device)
+                dtype = torch.uint8 if k == "env_obs" and self.obs_scale is not None else torch.float
+                self.obs[k] = torch.zeros((args.num_steps, args.num_envs) + shape, dtype=dtype).to(device)
         else:
             self.obs = torch.zeros((args.num_steps, args.num_envs) + self.obs_shape).to(device)
         self.actions = torch.zeros((args.num_steps, args.num_envs) + self.action_shape).to(device)
@@ -39,19 +60,29 @@ class PPOAlgorithm(Algorithm):
 
         self.global_step = 0
 
+    @staticmethod
+    def _to_tensor(x, device):
+        # NOTE: obs may already be on device (coord_env.obs_on_device)
+        if not torch.is_tensor(x):
+            x = torch.from_numpy(x)
+        return x.to(device).float()
+
     def _wrap_obs(self, obs):
         device = get_global_variable("device")
         if isinstance(self.obs_shape, dict):
             ret = {}
             for k, shape in self.obs_shape.items():
-                ret[k] = torch.from_numpy(obs[k] if not isinstance(obs[k], dict) else obs[k]['image']).to(device).float()
+                ret[k] = self._to_tensor(obs[k] if not isinstance(obs[k], dict) else obs[k]['image'], device)
             return ret
-        return torch.from_numpy(obs).to(device).float()
+        return self._to_tensor(obs, device)
 
     def _add_obs(self, step, next_obs):
         if isinstance(self.obs_shape, dict):
             for k, shape in self.obs_shape.items():
-                self.obs[k][step] = next_obs[k]
+                if self.obs[k].dtype == torch.uint8:
+                    self.obs[k][step] = (next_obs[k] * self.obs_scale).round().to(torch.uint8)
+                else:
+                    self.obs[k][step] = next_obs[k]
         else:
             self.obs[step] = next_obs
 
@@ -116,17 +147,10 @@ class PPOAlgorithm(Algorithm):
             # TRY NOT TO MODIFY: execute the game and log data.
             next_obs, reward, next_done, info = train_env.step(action.cpu().numpy())
 
-            # keep track of episode reward
-            for i in range(args.num_envs):
-                self.total_reward["reward"][i] += reward[i]
-                if "env_reward" in info[i]:
-                    self.total_reward["env_reward"][i] += info[i]["env_reward"]
-                if next_done[i]:
-                    # print("===>", step, reward[i], np.mean(log["reward"]))
-                    log["reward"].append(self.total_reward["reward"][i])
-                    log["env_reward"].append(self.total_reward["env_reward"][i])
-                    self.total_reward["reward"][i] = 0
-                    self.total_reward["env_reward"][i] = 0
+            # keep track of episode reward (CoordEnv accumulates it per env)
+            done_indices = next_done.nonzero()[0]
+            log["reward"].extend(info["episode_reward"][done_indices].tolist())
+            log["env_reward"].extend(info["episode_env_reward"][done_indices].tolist())
 
             self.rewards[step] = torch.from_numpy(reward).to(device).float().view(-1)
             next_obs, next_done = (
@@ -137,23 +161,9 @@ class PPOAlgorithm(Algorithm):
         # bootstrap value if not done
         with torch.no_grad():
             next_value = policy.get_value(next_obs).reshape(1, -1)
-            advantages = torch.zeros_like(self.rewards).to(device)
-            lastgaelam = 0
-            for t in reversed(range(args.num_steps)):
-                if t == args.num_steps - 1:
-                    nextnonterminal = 1.0 - next_done
-                    nextvalues = next_value
-                else:
-                    nextnonterminal = 1.0 - self.dones[t + 1]
-                    nextvalues = self.values[t + 1]
-                delta = (
-                        self.rewards[t]
-                        + args.gamma * nextvalues * nextnonterminal
-                        - self.values[t]
-                )
-                advantages[t] = lastgaelam = (
-                        delta + args.gamma * args.gae_lambda * nextnonterminal * lastgaelam
-                )
+            advantages = compute_gae(
+                self.rewards, self.values, self.dones, next_value, next_done, args.gamma, args.gae_lambda
+            )
             returns = advantages + self.values
 
         # flatten the batch
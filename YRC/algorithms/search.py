@@ -0,0 +1,123 @@
+import math
+import logging
+import pprint
+
+
+def make_search(config):
+    search = config.search if config.search is not None else "grid"
+    if search == "grid":
+        return GridSearch(config)
+    if search == "halving":
+        return HalvingSearch(config)
+    raise NotImplementedError(f"Unrecognized threshold search: {search}")
+
+
+def eval_candidates(policy, envs, evaluator, eval_splits, cand_params, num_episodes=None, best_summary=None):
+    # evaluates the candidates one after another, returns one split summary per candidate
+    stop_targets = None
+    if best_summary is not None:
+        stop_targets = {split: best_summary[split]["reward_mean"] for split in eval_splits}
+    split_summaries = []
+    for params in cand_params:
+        logging.info("Parameters: " + pprint.pformat(params, indent=2))
+        policy.update_params(params)
+        split_summaries.append(
+            evaluator.eval(policy, envs, eval_splits, num_episodes=num_episodes, stop_targets=stop_targets)
+        )
+    return split_summaries
+
+
+class GridSearch:
+    """Evaluates every candidate threshold with the full validation budget."""
+
+    def __init__(self, config):
+        self.batched = bool(config.batch_candidates)
+
+    def run(self, eval_fn, cand_thresholds, eval_splits, full_episodes, unit):
+        """Yields (threshold, split_summary) for every threshold evaluated with full_episodes episodes.
+
+        eval_fn(thresholds, splits, num_episodes) returns one split summary per threshold.
+        """
+        if self.batched:
+            yield from zip(cand_thresholds, eval_fn(cand_thresholds, eval_splits, full_episodes))
+            return
+        for threshold in cand_thresholds:
+            yield threshold, eval_fn([threshold], eval_splits, full_episodes)[0]
+
+
+class HalvingSearch:
+    """Successive halving over the candidate thresholds, then refinement around the best one.
+
+    All candidates are first evaluated on search_min_episodes episodes. After each round, only the best
+    1/search_eta of them, minus those clearly worse than the leader, are evaluated again with search_eta times
+    more episodes, until the full validation budget is reached. The episodes saved compared to a grid search
+    are spent on thresholds halfway between the best threshold and its neighbours. Each split is searched
+    separately.
+    """
+
+    def __init__(self, config):
+        assert not config.batch_candidates, "Batched candidates need the fixed candidate set of a grid search!"
+        self.eta = config.search_eta
+        self.min_episodes = config.search_min_episodes
+
+    def run(self, eval_fn, cand_thresholds, eval_splits, full_episodes, unit):
+        for split in eval_splits:
+            yield from self._run_split(eval_fn, cand_thresholds, split, full_episodes, unit)
+
+    def _run_split(self, eval_fn, cand_thresholds, split, full_episodes, unit):
+        budget = len(cand_thresholds) * full_episodes
+        thresholds = sorted(set(float(t) for t in cand_thresholds))
+
+        survivors = thresholds
+        num_episodes = self._round_episodes(self.min_episodes, full_episodes, unit)
+        while True:
+            logging.info(f"Search on {split}: {len(survivors)} candidates, {num_episodes} episodes each")
+            split_summaries = eval_fn(survivors, [split], num_episodes)
+            budget -= len(survivors) * num_episodes
+            results = {t: s[split] for t, s in zip(survivors, split_summaries)}
+            if num_episodes == full_episodes:
+                break
+            survivors = self._select(results)
+            num_episodes = self._round_episodes(num_episodes * self.eta, full_episodes, unit)
+
+        for t, summary in results.items():
+            yield t, {split: summary}
+
+        # refine around the best threshold with the remaining budget
+        known = sorted(set(thresholds) | set(results))
+        while budget >= full_episodes:
+            best = max(results, key=lambda t: results[t]["reward_mean"])
+            i = known.index(best)
+            new_thresholds = []
+            if i > 0:
+                new_thresholds.append((known[i - 1] + best) / 2)
+            if i < len(known) - 1:
+                new_thresholds.append((best + known[i + 1]) / 2)
+            new_thresholds = [t for t in new_thresholds if t not in known][:budget // full_episodes]
+            if not new_thresholds:
+                break
+
+            logging.info(f"Search on {split}: refining around {best}")
+            split_summaries = eval_fn(new_thresholds, [split], full_episodes)
+            budget -= len(new_thresholds) * full_episodes
+            for t, s in zip(new_thresholds, split_summaries):
+                results[t] = s[split]
+                yield t, {split: s[split]}
+            known = sorted(known + new_thresholds)
+
+    def _select(self, results):
+        def confidence(summary):
+            return 1.96 * summary["reward_std"] / len(summary["raw_reward"]) ** 0.5
+
+        ranked = sorted(results, key=lambda t: results[t]["reward_mean"], reverse=True)
+        leader = results[ranked[0]]
+        lower_bound = leader["reward_mean"] - confidence(leader)
+        # drop candidates whose upper bound is below the leader's lower bound
+        survivors = [t for t in ranked if results[t]["reward_mean"] + confidence(results[t]) >= lower_bound]
+        return sorted(survivors[:max(1, math.ceil(len(ranked) / self.eta))])
+
+    @staticmethod
+    def _round_episodes(num_episodes, full_episodes, unit):
+        # the evaluator runs whole batches of episodes
+        num_episodes = max(unit, math.ceil(num_episodes / unit) * unit)
+        return min(full_episodes, num_episodes)
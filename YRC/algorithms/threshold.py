@@ -1,14 +1,22 @@
-import numpy as np
 import pprint
 import logging
 from YRC.core import Algorithm
 from YRC.core.configs.global_configs import get_global_variable
+from YRC.algorithms.search import make_search, eval_candidates
 
 
 class ThresholdAlgorithm(Algorithm):
     def __init__(self, config, env):
         self.args = config
 
+    @property
+    def num_candidates(self):
+        return len(range(self.args.min_pct, self.args.max_pct, self.args.pct_step))
+
+    @property
+    def num_eval_slices(self):
+        return self.num_candidates if self.args.batch_candidates else 1
+
     def train(
             self,
             policy,
@@ -25,41 +33,76 @@ class ThresholdAlgorithm(Algorithm):
             best_summary[split] = {"reward_mean": -1e9}
 
         best_params = {}
-        scores = policy.generate_scores(envs["train"], args.num_rollouts)
-        cand_thresholds = [
-            np.percentile(scores, pct)
-            for pct in range(args.min_pct, args.max_pct, args.pct_step)
-        ]
+        # NOTE: one rollout scores every metric, the candidates of the other metrics are only logged
+        sketches = policy.generate_scores(envs["train"], args.num_rollouts)
+        metric_thresholds = {
+            metric: [
+                float(sketch.quantile(pct / 100))
+                for pct in range(args.min_pct, args.max_pct, args.pct_step)
+            ]
+            for metric, sketch in sketches.items()
+        }
+        for metric, thresholds in metric_thresholds.items():
+            logging.info(f"Candidate thresholds ({metric}): " + str(thresholds))
+        cand_thresholds = metric_thresholds[policy.args.metric]
 
         logging.info("Candidate thresholds: " + str(cand_thresholds))
 
-        for explore_temp in [1]:
-            for threshold in cand_thresholds:
-                params = {
-                    "threshold": threshold,
-                    "explore_temp": explore_temp,
-                    "score_temp": 1,
-                }
+        def eval_fn(thresholds, splits, num_episodes):
+            cand_params = [self._make_params(threshold) for threshold in thresholds]
+            return self._eval_candidates(policy, envs, evaluator, splits, cand_params, num_episodes, best_summary)
 
-                logging.info("Parameters: " + pprint.pformat(params, indent=2))
+        search = make_search(args)
+        for threshold, split_summary in search.run(
+                eval_fn,
+                cand_thresholds,
+                eval_splits,
+                evaluator.args.validation_episodes,
+                envs[eval_splits[0]].num_envs,
+        ):
+            params = self._make_params(threshold)
+            for split in split_summary:
+                if (
+                        split_summary[split]["reward_mean"]
+                        > best_summary[split]["reward_mean"]
+                ):
+                    best_params[split] = params
+                    best_summary[split] = split_summary[split]
+                    policy.update_params(params)
+                    policy.save_model(f"best_{split}", save_dir)
 
-                policy.update_params(params)
-                split_summary = evaluator.eval(policy, envs, eval_splits)
+                # log best result so far
+                logging.info(f"Best {split} so far")
+                logging.info(
+                    "Parameters: " + pprint.pformat(best_params[split], indent=2)
+                )
+                evaluator.write_summary(f"best_{split}", best_summary[split])
 
-                for split in eval_splits:
-                    if (
-                            split_summary[split]["reward_mean"]
-                            > best_summary[split]["reward_mean"]
-                    ):
-                        best_params[split] = params
-                        best_summary[split] = split_summary[split]
-                        policy.save_model(f"best_{split}", save_dir)
+        policy.update_params(best_params)
 
-                    # log best result so far
-                    logging.info(f"Best {split} so far")
-                    logging.info(
-                        "Parameters: " + pprint.pformat(best_params[split], indent=2)
-                    )
-                    evaluator.write_summary(f"best_{split}", best_summary[split])
+    @staticmethod
+    def _make_params(threshold):
+        return {
+            "threshold": threshold,
+            "explore_temp": 1,
+            "score_temp": 1,
+        }
 
-        policy.update_params(best_params)
+    def _eval_candidates(self, policy, envs, evaluator, eval_splits, cand_params, num_episodes, best_summary):
+        if not self.args.batch_candidates:
+            return eval_candidates(policy, envs, evaluator, eval_splits, cand_params, num_episodes, best_summary)
+
+        # NOTE: all candidates share the rollouts of a wide env (see train.py), candidate i acting on its i-th slice
+        wide_splits = [f"{split}_wide" for split in eval_splits]
+        assert envs[wide_splits[0]].num_envs == len(cand_params) * envs[eval_splits[0]].num_envs
+        # NOTE: candidates only differ by threshold, the temperatures stay scalar
+        batched_params = dict(cand_params[0], threshold=[params["threshold"] for params in cand_params])
+        logging.info("Parameters: " + pprint.pformat(batched_params, indent=2))
+        policy.update_params(batched_params)
+        wide_summary = evaluator.eval(
+            policy, envs, wide_splits, num_episodes=num_episodes, num_slices=len(cand_params)
+        )
+        return [
+            {split: wide_summary[f"{split}_wide"][i] for split in eval_splits}
+            for i in range(len(cand_params))
+        ]
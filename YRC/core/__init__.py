@@ -1,4 +1,4 @@
 from .algorithm import Algorithm
 from .policy import Policy
 from .evaluator import Evaluator
-from .environment import CoordEnv
+from .environment import CoordEnv, StepInfo
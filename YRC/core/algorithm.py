@@ -14,6 +14,9 @@ def make(config, env):
 
 
 class Algorithm:
+    # number of policies evaluated side by side on slices of wide envs (see make_wide_envs)
+    num_eval_slices = 1
+
     def train(
         self,
         policy,
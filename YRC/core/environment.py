@@ -6,31 +6,43 @@ if importlib.util.find_spec("gymnasium") is None:
 else:
     import gymnasium as gym  # used for minigrid
 import numpy as np
+import os
 import pprint
 import json
+import hashlib
+import tempfile
+import torch
 
-from copy import deepcopy as dc
+from concurrent.futures import ThreadPoolExecutor
+from filelock import FileLock
 
 from YRC.core import Evaluator
 from YRC.core.configs import get_global_variable
+from YRC.core.policy import get_obs_keys
 
 
 def make(config):
     base_envs = make_raw_envs(config)
     sim_weak_agent, weak_agent, strong_agent = load_agents(config, base_envs["val_sim"])
+    if config.coord_env.logit_summary:
+        assert get_global_variable("benchmark") == "cliport", "Logit summaries are only supported for cliport!"
+        for agent in [sim_weak_agent, weak_agent]:
+            agent.set_logit_summary(True)
+    obs_keys = get_obs_keys(config)
+    logging.info(f"Coordination observation keys: {obs_keys}")
 
     coord_envs = {}
     for name in base_envs:
         if config.general.skyline or name not in ["train", "val_sim"]:
             if type(strong_agent) is dict:
-                coord_envs[name] = CoordEnv(config.coord_env, base_envs[name], weak_agent, strong_agent[name])
+                coord_envs[name] = CoordEnv(config.coord_env, base_envs[name], weak_agent, strong_agent[name], obs_keys)
             else:
-                coord_envs[name] = CoordEnv(config.coord_env, base_envs[name], weak_agent, strong_agent)
+                coord_envs[name] = CoordEnv(config.coord_env, base_envs[name], weak_agent, strong_agent, obs_keys)
         else:
             # NOTE: not skyline and name in ["train", "val_sim"]
             # use weak agent as strong agent
             # use sim_weak agent as weak agent
-            coord_envs[name] = CoordEnv(config.coord_env, base_envs[name], sim_weak_agent, weak_agent)
+            coord_envs[name] = CoordEnv(config.coord_env, base_envs[name], sim_weak_agent, weak_agent, obs_keys)
 
     # set costs for getting help from strong agent
     test_eval_info = get_test_eval_info(config, coord_envs)
@@ -66,49 +78,136 @@ def check_coord_envs(envs):
 
 
 def get_test_eval_info(config, coord_envs):
-    with open("YRC/core/test_eval_info.json") as f:
-        data = json.load(f)
-
-    backup_data = dc(data)
-
     benchmark = config.general.benchmark
     env_name = config.environment.common.env_name
-
-    if env_name not in data[benchmark]:
-        logging.info(f"Missing info about {benchmark}-{env_name}!")
-        logging.info("Calculating missing info (taking a few minutes)...")
-        evaluator = Evaluator(config.evaluation)
-        # eval strong agent on test environment to get statistics
-        summary = evaluator.eval(
-            coord_envs["test"].strong_agent,
-            {"test": coord_envs["test"].base_env},
-            ["test"],
-            num_episodes=coord_envs["test"].num_envs,
-        )["test"]
-        data[benchmark][env_name] = summary
-
-        with open("YRC/core/backup_test_eval_info.json", "w") as f:
-            json.dump(backup_data, f, indent=2)
-        with open("YRC/core/test_eval_info.json", "w") as f:
-            json.dump(data, f, indent=2)
-        logging.info("Saved info!")
-
-    ret = data[benchmark][env_name]
+    cache_path = get_calibration_cache_path(config)
+    key = get_calibration_key(config)
+
+    ret = read_json(cache_path).get(key)
+    if ret is None:
+        # fall back to the statistics shipped with the repo for the released checkpoints
+        legacy_data = read_json("YRC/core/test_eval_info.json")
+        ret = legacy_data.get(benchmark, {}).get(env_name)
+
+    if ret is None:
+        # NOTE: only one process computes a missing entry, the others wait on the lock and then read it
+        with FileLock(cache_path + ".lock"):
+            data = read_json(cache_path)
+            if key not in data:
+                logging.info(f"Missing info about {benchmark}-{env_name}!")
+                logging.info("Calculating missing info (taking a few minutes)...")
+                evaluator = Evaluator(config.evaluation)
+                # eval strong agent on test environment to get statistics
+                summary = evaluator.eval(
+                    coord_envs["test"].strong_agent,
+                    {"test": coord_envs["test"].base_env},
+                    ["test"],
+                    num_episodes=coord_envs["test"].num_envs,
+                )["test"]
+                data[key] = summary
+                write_json_atomic(cache_path, data)
+                logging.info(f"Saved info to {cache_path}!")
+            ret = data[key]
 
     logging.info(f"{pprint.pformat(ret, indent=2)}")
     return ret
 
 
-def make_raw_envs(config):
+def get_calibration_cache_path(config):
+    cache_path = config.evaluation.calibration_cache
+    if cache_path is None:
+        cache_dir = os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+        cache_path = os.path.join(cache_dir, "yrc", "test_eval_info.json")
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    return cache_path
+
+
+def get_calibration_key(config):
+    eval_config = {
+        "evaluation": {
+            k: v for k, v in config.evaluation.as_dict().items()
+            if k not in ("calibration_cache", "cost_ratios", "early_stop")
+        },
+        "environment": {
+            "common": config.environment.common.as_dict(),
+            "test": config.environment.test.as_dict(),
+        },
+    }
+    eval_hash = hashlib.sha256(json.dumps(eval_config, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    strong_path = config.agents.strong
+    strong_hash = hash_file(strong_path)[:16] if strong_path is not None else "oracle"
+    return "/".join((config.general.benchmark, config.environment.common.env_name, strong_hash, eval_hash))
+
+
+def hash_file(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def read_json(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json_atomic(path, data):
+    # write to a temporary file in the same directory, then rename it over the target
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def make_wide_envs(config, coord_envs, names, num_copies):
+    """Coordination envs whose batch is num_copies times the original one, e.g. one slice per candidate policy.
+
+    The weak and strong agents and the costs are shared with coord_envs.
+    """
+    assert get_global_variable("benchmark") != "minigrid", "Wide envs do not support recurrent agents!"
+    common_config = config.environment.common
+    num_envs = common_config.num_envs
+    common_config.num_envs = num_envs * num_copies
+    base_envs = make_raw_envs(config, names)
+    common_config.num_envs = num_envs
+
+    wide_envs = {}
+    for name in names:
+        env = coord_envs[name]
+        wide_env = CoordEnv(config.coord_env, base_envs[name], env.weak_agent, env.strong_agent, env.obs_keys)
+        wide_env.reward_per_action = env.reward_per_action
+        wide_env.strong_query_cost_per_action = env.strong_query_cost_per_action
+        wide_env.switch_agent_cost_per_action = env.switch_agent_cost_per_action
+        wide_env.reset()
+        wide_envs[name] = wide_env
+
+    return wide_envs
+
+
+def make_raw_envs(config, names=("train", "val_sim", "val_true", "test")):
     module = importlib.import_module(f"YRC.envs.{get_global_variable('benchmark')}")
     create_fn = getattr(module, "create_env")
 
+    num_parts = config.coord_env.pipeline_parts if config.coord_env.pipelined else 1
+    if num_parts is not None and num_parts > 1:
+        assert get_global_variable("benchmark") == "procgen", "Pipelined sub-batches only support procgen!"
+
     envs = {}
-    for name in ["train", "val_sim", "val_true", "test"]:
-        if name == "train" and config.general.skyline:
-            env = create_fn("test", config.environment)
+    for name in names:
+        create_name = "test" if name == "train" and config.general.skyline else name
+        if num_parts is not None and num_parts > 1:
+            env = create_split_env(create_fn, create_name, config.environment, num_parts)
         else:
-            env = create_fn(name, config.environment)
+            env = create_fn(create_name, config.environment)
         # some extra information
         env.name = config.environment.common.env_name
         envs[name] = env
@@ -116,6 +215,26 @@ def make_raw_envs(config):
     return envs
 
 
+def create_split_env(create_fn, name, env_config, num_parts):
+    common_config = env_config.common
+    specific_config = getattr(env_config, name)
+    num_envs, seed = common_config.num_envs, specific_config.seed
+    assert num_envs % num_parts == 0, f"num_envs ({num_envs}) must be divisible by pipeline_parts ({num_parts})"
+
+    # NOTE: every part gets its own seed, otherwise the sub-batches would replay the same levels. The level
+    # streams therefore differ from those of an unsplit env with the same seed: pipelined results are not
+    # comparable episode by episode with non-pipelined ones
+    logging.warning(f"{name}: pipelined sub-batches use seeds {seed}..{seed + num_parts - 1}, levels differ from an unsplit env")
+    common_config.num_envs = num_envs // num_parts
+    parts = []
+    for i in range(num_parts):
+        specific_config.seed = seed + i
+        parts.append(create_fn(name, env_config))
+    common_config.num_envs, specific_config.seed = num_envs, seed
+
+    return SplitVecEnv(parts)
+
+
 def load_agents(config, env):
     module = importlib.import_module(f"YRC.envs.{get_global_variable('benchmark')}")
     load_fn = getattr(module, "load_policy")
@@ -127,11 +246,97 @@ def load_agents(config, env):
     return sim_weak_agent, weak_agent, strong_agent
 
 
+# fills the end of action rows that are narrower than the widest row of their batch (cliport pick/place
+# are optional), envs strip it with strip_action_pad before decoding a row
+ACTION_PAD = np.nan
+
+
+def strip_action_pad(action):
+    end = len(action)
+    while end > 0 and isinstance(action[end - 1], float) and np.isnan(action[end - 1]):
+        end -= 1
+    return action[:end]
+
+
+class StepInfo:
+    """Step info of a batch of environments, stored as numpy columns (one entry per env).
+
+    Columns are accessed by name (``info["env_reward"]``). The legacy per-env dicts are
+    built on request with ``info[i]`` or ``info.as_list()``.
+    """
+
+    def __init__(self, columns, env_info=None):
+        self.columns = columns
+        self.env_info = env_info if env_info is not None else []
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.columns[key]
+        item = dict(self.env_info[key]) if len(self.env_info) > 0 else {}
+        for k, v in self.columns.items():
+            if k not in item:
+                item[k] = v[key]
+        return item
+
+    def __contains__(self, key):
+        return key in self.columns
+
+    def __len__(self):
+        return len(self.columns["done"])
+
+    def __iter__(self):
+        return iter(self.as_list())
+
+    def as_list(self):
+        return [self[i] for i in range(len(self))]
+
+
+class SplitVecEnv:
+    """Vectorized env made of several sub-batches, each stepped independently by a pipelined CoordEnv.
+
+    Used as a whole, it behaves like a single env whose batch is the concatenation of its parts.
+    """
+
+    def __init__(self, envs):
+        self.envs = envs
+        self.observation_space = envs[0].observation_space
+        self.action_space = envs[0].action_space
+        self.obs_shape = envs[0].obs_shape
+        # optional attributes set by the benchmark's create_env
+        self.obs_scale = getattr(envs[0], "obs_scale", None)
+        self.num_envs = sum(env.num_envs for env in envs)
+
+        self.slices = []
+        start = 0
+        for env in envs:
+            self.slices.append(slice(start, start + env.num_envs))
+            start += env.num_envs
+
+    def reset(self):
+        return np.concatenate([env.reset() for env in self.envs])
+
+    def step(self, actions):
+        return self.merge_results([env.step(actions[sl]) for sl, env in zip(self.slices, self.envs)])
+
+    @staticmethod
+    def merge_results(results):
+        obs, rews, dones, infos = zip(*results)
+        columns = {k: np.concatenate([info[k] for info in infos]) for k in infos[0].columns}
+        env_info = [item for info in infos for item in info.env_info]
+        return np.concatenate(obs), np.concatenate(rews), np.concatenate(dones), StepInfo(columns, env_info)
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+
 class CoordEnv(gym.Env):
     WEAK = 0
     STRONG = 1
 
-    def __init__(self, config, base_env, weak_agent, strong_agent):
+    OBS_KEYS = ["env_obs", "weak_features", "weak_logit"]
+
+    def __init__(self, config, base_env, weak_agent, strong_agent, obs_keys=None):
         self.args = config
         self.base_env = base_env
         if isinstance(base_env.observation_space, list):
@@ -142,6 +347,24 @@ class CoordEnv(gym.Env):
             obs_space = base_env.observation_space
         self.weak_agent = weak_agent
         self.strong_agent = strong_agent
+        self.weak_output = None
+
+        # sub-batches stepped on worker threads by step_async/step_wait
+        if isinstance(base_env, SplitVecEnv):
+            self.parts = list(zip(base_env.slices, base_env.envs))
+        else:
+            self.parts = [(slice(None), base_env)]
+        self.executor = None
+        self.pending_steps = None
+        # NOTE: env_obs is always returned since it costs nothing, weak_* keys are only computed when requested
+        if obs_keys is None:
+            obs_keys = self.OBS_KEYS
+        self.obs_keys = [k for k in self.OBS_KEYS if k == "env_obs" or k in obs_keys]
+        self.needs_weak_output = "weak_features" in self.obs_keys or "weak_logit" in self.obs_keys
+
+        self.running_reward = np.zeros(self.num_envs)
+        self.running_env_reward = np.zeros(self.num_envs)
+        self.running_length = np.zeros(self.num_envs, dtype=np.int64)
 
         self.action_space = gym.spaces.Discrete(2)
         self.observation_space = gym.spaces.Dict(
@@ -157,15 +380,16 @@ class CoordEnv(gym.Env):
     def set_costs(self, test_eval_info):
         length = test_eval_info["episode_length_mean"]
         reward = test_eval_info["reward_mean"]
-        reward_per_action = reward / length
+        self.reward_per_action = reward / length
 
-        self.strong_query_cost_per_action = round(
-            reward_per_action * self.args.strong_query_cost_ratio, 2
-        )
+        self.strong_query_cost_per_action = self.get_strong_query_cost(self.args.strong_query_cost_ratio)
         self.switch_agent_cost_per_action = round(
-            reward_per_action * self.args.switch_agent_cost_ratio, 2
+            self.reward_per_action * self.args.switch_agent_cost_ratio, 2
         )
 
+    def get_strong_query_cost(self, strong_query_cost_ratio):
+        return round(self.reward_per_action * strong_query_cost_ratio, 2)
+
     @property
     def num_envs(self):
         return self.base_env.num_envs
@@ -180,15 +404,20 @@ class CoordEnv(gym.Env):
 
     @property
     def obs_shape(self):
-        return {
+        shapes = {
             "env_obs": self.base_env.obs_shape,
             "weak_features": (self.weak_agent.hidden_dim,),
-            "weak_logit": (self.base_env.action_space.n,),
+            "weak_logit": (self.weak_agent.model.logit_dim,),
         }
+        return {k: shapes[k] for k in self.obs_keys}
 
     def reset(self):
         self.prev_action = None
         self.env_obs = self.base_env.reset()
+        self.weak_output = None
+        self.running_reward[:] = 0
+        self.running_env_reward[:] = 0
+        self.running_length[:] = 0
         self._reset_agents(np.array([True] * self.num_envs))
         return self.get_obs()
 
@@ -197,54 +426,168 @@ class CoordEnv(gym.Env):
         self.strong_agent.reset(done)
 
     def step(self, action):
-        env_action = self._compute_env_action(action)
-        self.env_obs, env_reward, done, env_info = self.base_env.step(env_action)
+        # NOTE: the coordination policy acts on the whole batch between steps, so its inference never overlaps
+        # simulation; pipelining only overlaps the agents of one sub-batch with the simulation of the others
+        if self.args.pipelined:
+            self.step_async(action)
+            return self.step_wait()
 
-        info = dc(env_info)
-        if len(info) == 0:
-            info = [{"env_reward": 0, "env_action": 0}] * self.num_envs
-        for i, item in enumerate(info):
-            if "env_reward" not in item:
-                item["env_reward"] = env_reward[i]
-            item["env_action"] = env_action[i]
-
-        reward = self._get_reward(env_reward, action, done)
+        env_action = self._compute_env_action(action)
+        return self._finish_step(action, env_action, self.base_env.step(env_action))
+
+    def step_async(self, action):
+        if self.pending_steps is not None:
+            raise RuntimeError("CoordEnv is already stepping!")
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=len(self.parts))
+
+        # NOTE: actions of a part are computed while the previous parts are already simulating
+        env_actions = []
+        self.pending_steps = []
+        for sl, env in self.parts:
+            env_action = self._compute_env_action(action, sl)
+            env_actions.append(env_action)
+            self.pending_steps.append(self.executor.submit(env.step, env_action))
+        self.pending_action = action
+        self.pending_env_action = env_actions[0] if len(env_actions) == 1 else np.concatenate(env_actions)
+
+    def step_wait(self):
+        if self.pending_steps is None:
+            raise RuntimeError("CoordEnv is not stepping!")
+
+        # NOTE: when the obs needs weak outputs, run the weak agent on each part while the next ones are still simulating
+        prefetch_weak = len(self.parts) > 1 and self.needs_weak_output
+        results, weak_outputs = [], []
+        for future in self.pending_steps:
+            result = future.result()
+            results.append(result)
+            if prefetch_weak:
+                weak_outputs.append(self.weak_agent.infer(result[0], greedy=self.args.act_greedy))
+        self.pending_steps = None
+
+        step_result = results[0] if len(results) == 1 else SplitVecEnv.merge_results(results)
+        weak_output = self._merge_weak_outputs(weak_outputs) if prefetch_weak else None
+        return self._finish_step(self.pending_action, self.pending_env_action, step_result, weak_output)
+
+    def _finish_step(self, action, env_action, step_result, weak_output=None):
+        self.env_obs, env_reward, done, env_info = step_result
+        self.weak_output = weak_output
+
+        switched = self._get_charged_switches(action, done)
+        reward = self._get_reward(env_reward, action, switched)
+        # which envs were charged the strong query / switch cost at this step
+        columns = {"strong_query": action == self.STRONG, "agent_switch": switched}
+        info = self._update_info(columns, reward, env_reward, env_action, done, env_info)
         self._reset_agents(done)
         self.prev_action = action
 
         return self.get_obs(), reward, done, info
 
-    def _compute_env_action(self, action):
+    @staticmethod
+    def _merge_weak_outputs(outputs):
+        hidden, logit, action = zip(*outputs)
+        return torch.cat(hidden), torch.cat(logit), np.concatenate(action)
+
+    def _update_info(self, columns, reward, env_reward, env_action, done, env_info):
+        # NOTE: every step gets new columns, so callers may keep the info of past steps
+        # wrappers report the raw env reward when the step reward is normalized
+        raw_env_reward = env_info["env_reward"] if "env_reward" in env_info else env_reward
+        columns["env_reward"] = np.array(raw_env_reward, dtype=np.float64)
+        columns["done"] = np.array(done, dtype=bool)
+
+        self.running_reward += reward
+        self.running_env_reward += columns["env_reward"]
+        self.running_length += 1
+        # episode stats are only meaningful where done is set
+        columns["episode_reward"] = self.running_reward.copy()
+        columns["episode_env_reward"] = self.running_env_reward.copy()
+        columns["episode_length"] = self.running_length.copy()
+        self.running_reward[done] = 0
+        self.running_env_reward[done] = 0
+        self.running_length[done] = 0
+
+        columns["env_action"] = env_action
+        if isinstance(env_info, StepInfo):
+            env_info = env_info.env_info
+        return StepInfo(columns, env_info)
+
+    def _compute_env_action(self, action, sl=slice(None)):
         # NOTE: this method only works with non-recurrent agent models
         greedy = self.args.act_greedy
+        action = action[sl]
         is_weak = (action == self.WEAK)
         is_strong = ~is_weak
 
         if isinstance(self.env_obs, dict):
             if is_weak.any():
-                env_action = self.weak_agent.act(self.env_obs, greedy=greedy)
+                if self._use_weak_output():
+                    env_action = self._weak_inference()[2]
+                else:
+                    env_action = self.weak_agent.act(self.env_obs, greedy=greedy)
             if is_strong.any():
                 if get_global_variable('benchmark') == 'cliport':
-                    env_action = self.strong_agent.act(self.env_obs, self.base_env, greedy=greedy)
+                    strong_action = self.strong_agent.act(self.env_obs, self.base_env, greedy=greedy)
+                    # vectorized cliport envs mix weak and strong actions row by row
+                    env_action = self._merge_actions(env_action, strong_action, is_strong) if is_weak.any() else strong_action
                 else:
                     env_action = self.strong_agent.act(self.env_obs, greedy=greedy)
         else:
+            env_obs = self.env_obs[sl]
             env_action = np.zeros_like(action)
             if is_weak.any():
-                env_action[is_weak] = self.weak_agent.act(self.env_obs[is_weak], greedy=greedy)
+                if self._use_weak_output():
+                    env_action[is_weak] = self._weak_inference()[2][sl][is_weak]
+                else:
+                    env_action[is_weak] = self.weak_agent.act(env_obs[is_weak], greedy=greedy)
             if is_strong.any():
-                env_action[is_strong] = self.strong_agent.act(self.env_obs[is_strong], greedy=greedy)
+                env_action[is_strong] = self.strong_agent.act(env_obs[is_strong], greedy=greedy)
+        return env_action
+
+    @staticmethod
+    def _merge_actions(weak_action, strong_action, is_strong):
+        # NOTE: rows may differ in width (e.g. cliport oracle actions have no pick/place), see ACTION_PAD
+        width = max(weak_action.shape[1], strong_action.shape[1])
+        env_action = np.full((weak_action.shape[0], width), ACTION_PAD, dtype=object)
+        env_action[~is_strong, :weak_action.shape[1]] = weak_action[~is_strong]
+        env_action[is_strong, :strong_action.shape[1]] = strong_action[is_strong]
         return env_action
 
+    def _use_weak_output(self):
+        # NOTE: without weak_* obs keys, the weak action comes from act, which skips the features and logit
+        return self.weak_output is not None or self.needs_weak_output
+
+    def _weak_inference(self):
+        # NOTE: the weak agent runs once per observation; features, logit and action are cached until the next step
+        if self.weak_output is None:
+            self.weak_output = self.weak_agent.infer(self.env_obs, greedy=self.args.act_greedy)
+        return self.weak_output
+
     def get_obs(self):
-        obs = {
-            "env_obs": self.env_obs,
-            "weak_features": self.weak_agent.get_hidden(self.env_obs).detach().cpu().numpy(),
-            "weak_logit": self.weak_agent.forward(self.env_obs).detach().cpu().numpy(),
-        }
+        obs = {"env_obs": self.env_obs}
+        if self.needs_weak_output:
+            weak_features, weak_logit, _ = self._weak_inference()
+            if "weak_features" in self.obs_keys:
+                obs["weak_features"] = self._wrap_weak_output(weak_features)
+            if "weak_logit" in self.obs_keys:
+                obs["weak_logit"] = self._wrap_weak_output(weak_logit)
         return obs
 
-    def _get_reward(self, env_reward, action, done):
+    def _wrap_weak_output(self, x):
+        # NOTE: with obs_on_device, weak agent outputs stay as tensors on the model device
+        x = x.detach()
+        if self.args.obs_on_device:
+            return x
+        return x.cpu().numpy()
+
+    def _get_charged_switches(self, action, done):
+        switched = np.zeros(self.num_envs, dtype=bool)
+        if self.prev_action is not None:
+            switch_indices = ((action != self.prev_action) & (~done)).nonzero()[0]
+            if switch_indices.size > 1:
+                switched[switch_indices] = True
+        return switched
+
+    def _get_reward(self, env_reward, action, switched):
         # cost of querying strong agent
         reward = np.where(
             action == self.STRONG,
@@ -253,12 +596,12 @@ class CoordEnv(gym.Env):
         )
 
         # cost of switching
-        if self.prev_action is not None:
-            switch_indices = ((action != self.prev_action) & (~done)).nonzero()[0]
-            if switch_indices.size > 1:
-                reward[switch_indices] -= self.switch_agent_cost_per_action
+        reward[switched] -= self.switch_agent_cost_per_action
 
         return reward
 
     def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
         return self.base_env.close()
@@ -14,7 +14,15 @@ class Evaluator:
         self.iter = 0
         self.run_id= seed
 
-    def eval(self, policy, envs, eval_splits, num_episodes=None):
+    def eval(self, policy, envs, eval_splits, num_episodes=None, num_slices=1, stop_targets=None):
+        """Evaluate policy on each split for num_episodes episodes.
+
+        With num_slices > 1, the env batch is made of num_slices contiguous slices that are summarized
+        separately (num_episodes each), and the summary of a split is a list with one entry per slice.
+
+        With early_stop enabled, the evaluation of a split stops as soon as the confidence interval of the
+        mean reward lies below stop_targets[split] (e.g. the best reward so far in a sweep).
+        """
         args = self.args
         policy.eval()
 
@@ -34,39 +42,87 @@ class Evaluator:
                 else:
                     assert "test" in split
                     num_episodes = args.test_episodes
-                assert num_episodes % envs[split].num_envs == 0
+            slice_size = envs[split].num_envs // num_slices
+            assert num_episodes % slice_size == 0
 
             logging.info(f"Evaluation on {split} for {num_episodes} episodes")
 
-            num_iterations = num_episodes // envs[split].num_envs
+            num_iterations = num_episodes // slice_size
+            stop_target = None
+            if args.early_stop and stop_targets is not None and num_slices == 1:
+                stop_target = stop_targets.get(split)
+
             log = {}
-            for _ in range(num_iterations):
+            for i in range(num_iterations):
                 this_log = self._eval_one_iteration(policy, envs[split], img_dir)
                 self._update_log(log, this_log)
+                if stop_target is not None and i < num_iterations - 1 and self._is_dominated(log, stop_target):
+                    logging.info(f"Stopped after {len(log['reward'])} episodes, dominated by {stop_target:.2f}")
+                    break
 
-            summary[split] = self.summarize(log)
-            self.write_summary(split, summary[split])
+            if num_slices == 1:
+                summary[split] = self._summarize_split(envs[split], log)
+                self.write_summary(split, summary[split])
+            else:
+                summary[split] = []
+                for i, slice_log in enumerate(self.split_log(log, num_slices, envs[split].num_envs)):
+                    summary[split].append(self._summarize_split(envs[split], slice_log))
+                    logging.info(f"Slice {i}")
+                    self.write_summary(split, summary[split][-1])
 
             envs[split].close()
+            self._log_agent_stats(envs[split])
 
         return summary
 
+    @staticmethod
+    def _log_agent_stats(env):
+        # NOTE: agents may expose runtime statistics, e.g. the language embedding cache of cliport agents
+        for name in ["weak_agent", "strong_agent"]:
+            agent = getattr(env, name, None)
+            if hasattr(agent, "stats"):
+                logging.info(f"{name} stats: {agent.stats()}")
+
     def _update_log(self, log, this_log):
         if not log:
             log.update(this_log)
+            return
         for k, v in this_log.items():
             if isinstance(v, list):
                 log[k].extend(v)
             else:
                 log[k] += v
+
+    @staticmethod
+    def _is_dominated(log, target):
+        rewards = np.asarray(log["reward"])
+        upper_bound = rewards.mean() + 1.96 * rewards.std() / len(rewards) ** 0.5
+        return upper_bound < target
+
+    @staticmethod
+    def split_log(log, num_slices, num_envs):
+        # NOTE: per-env lists are laid out iteration by iteration, each holding the whole env batch
+        slice_logs = [{} for _ in range(num_slices)]
+        for k, v in log.items():
+            v = np.asarray(v).reshape(-1, num_slices, num_envs // num_slices)
+            for i in range(num_slices):
+                slice_logs[i][k] = v[:, i].reshape(-1).tolist()
+        return slice_logs
+
+    def _summarize_split(self, env, log):
+        summary = self.summarize(log)
+        if self.args.cost_ratios and "strong_queries" in log:
+            summary.update(self.summarize_costs(env, log))
+        return summary
+
     def _eval_one_iteration(self, policy, env, img_dir):
         args = self.args
-        log = {
-            "reward": [0] * env.num_envs,
-            "env_reward": [0] * env.num_envs,
-            "episode_length": [0] * env.num_envs,
-            f"action_{self.LOGGED_ACTION}": 0,
-        }
+        reward_sum = np.zeros(env.num_envs)
+        env_reward_sum = np.zeros(env.num_envs)
+        episode_length = np.zeros(env.num_envs, dtype=np.int64)
+        logged_action_count = np.zeros(env.num_envs, dtype=np.int64)
+        strong_queries = np.zeros(env.num_envs, dtype=np.int64)
+        switches = np.zeros(env.num_envs, dtype=np.int64)
 
         obs = env.reset()
         has_done = np.array([False] * env.num_envs)
@@ -96,23 +152,36 @@ class Evaluator:
             action = policy.act(obs, greedy=args.act_greedy)
             obs, reward, done, info= env.step(action)
 
-            for i in range(env.num_envs):
-                if "env_reward" in info[i]:
-                    log["env_reward"][i] += info[i]["env_reward"] * (1 - has_done[i])
-
-                log["reward"][i] += reward[i] * (1 - has_done[i])
-                log["episode_length"][i] += 1 - has_done[i]
-                if not has_done[i]:
-                    log[f"action_{self.LOGGED_ACTION}"] += (action[i] == self.LOGGED_ACTION).sum()
+            active = ~has_done
+            env_reward_sum += info["env_reward"] * active
+            reward_sum += reward * active
+            episode_length += active
+            # NOTE: env actions can have trailing dims (e.g. cliport poses), counted per env as before
+            is_logged = np.asarray(action) == self.LOGGED_ACTION
+            logged_action_count += is_logged.reshape(env.num_envs, -1).sum(axis=-1) * active
+            # NOTE: coordination envs report which envs were charged, so the reward can be recomputed for other costs
+            if "strong_query" in info:
+                strong_queries += info["strong_query"] & active
+                switches += info["agent_switch"] & active
 
             has_done |= done
             step += 1
 
         self.iter += 1
+        log = {
+            "reward": reward_sum.tolist(),
+            "env_reward": env_reward_sum.tolist(),
+            "episode_length": episode_length.tolist(),
+            f"action_{self.LOGGED_ACTION}": logged_action_count.tolist(),
+        }
+        if "strong_query" in info:
+            log["strong_queries"] = strong_queries.tolist()
+            log["switches"] = switches.tolist()
         return log
 
     def summarize(self, log):
         return {
+            "episodes": len(log["reward"]),
             "steps": int(sum(log["episode_length"])),
             "episode_length_mean": float(np.mean(log["episode_length"])),
             "episode_length_min": int(np.min(log["episode_length"])),
@@ -123,12 +192,29 @@ class Evaluator:
             "env_reward_mean": float(np.mean(log["env_reward"])),
             "env_reward_std": float(np.std(log["env_reward"])),
             f"action_{self.LOGGED_ACTION}_frac": float(
-                log[f"action_{self.LOGGED_ACTION}"] / sum(log["episode_length"])
+                sum(log[f"action_{self.LOGGED_ACTION}"]) / sum(log["episode_length"])
             ),
         }
 
+    def summarize_costs(self, env, log):
+        # the trajectory does not depend on the strong query cost, only the charged reward does
+        reward = np.array(log["reward"])
+        strong_queries = np.array(log["strong_queries"])
+        raw_reward_by_cost = {}
+        for ratio in self.args.cost_ratios:
+            cost_diff = env.strong_query_cost_per_action - env.get_strong_query_cost(ratio)
+            raw_reward_by_cost[str(ratio)] = (reward + cost_diff * strong_queries).tolist()
+        return {
+            "strong_queries_mean": float(np.mean(strong_queries)),
+            "switches_mean": float(np.mean(log["switches"])),
+            "reward_mean_by_cost": {k: float(np.mean(v)) for k, v in raw_reward_by_cost.items()},
+            "reward_std_by_cost": {k: float(np.std(v)) for k, v in raw_reward_by_cost.items()},
+            "raw_reward_by_cost": raw_reward_by_cost,
+        }
+
     def write_summary(self, split, summary):
-        log_str = f"   Steps:       {summary['steps']}\n"
+        log_str = f"   Episodes:    {summary['episodes']}\n"
+        log_str += f"   Steps:       {summary['steps']}\n"
         log_str += "   Episode:    "
         log_str += f"mean {summary['episode_length_mean']:7.2f}  "
         log_str += f"min {summary['episode_length_min']:7.2f}  "
@@ -143,6 +229,17 @@ class Evaluator:
         log_str += "   Raw Rewards: "
         for r in summary["raw_reward"]:
             log_str += f"{r:.2f},"
+        if "raw_reward_by_cost" in summary:
+            log_str += f"\n   Strong queries: mean {summary['strong_queries_mean']:.2f}  "
+            log_str += f"Switches: mean {summary['switches_mean']:.2f}"
+            for ratio, rewards in summary["raw_reward_by_cost"].items():
+                log_str += f"\n   Reward (qc {ratio}): "
+                log_str += f"mean {summary['reward_mean_by_cost'][ratio]:.2f} "
+                log_str += f"± {(1.96 * summary['reward_std_by_cost'][ratio]) / (len(rewards) ** 0.5):.2f}"
+            for ratio, rewards in summary["raw_reward_by_cost"].items():
+                log_str += f"\n   Raw Rewards (qc {ratio}): "
+                for r in rewards:
+                    log_str += f"{r:.2f},"
         logging.info(log_str)
 
         return summary
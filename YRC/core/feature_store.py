@@ -0,0 +1,135 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import numpy as np
+
+from YRC.core.environment import hash_file
+
+
+def make(config):
+    """Returns the feature store under config.algorithm.feature_store, None if it is disabled."""
+    if config.algorithm.feature_store is None:
+        return None
+    return FeatureStore(config.algorithm.feature_store, lambda: get_rollout_key(config))
+
+
+# coord_env options that only change how the rollouts are computed, not the features they produce
+EXECUTION_OPTIONS = ["obs_on_device", "pipelined", "pipeline_parts"]
+
+
+def get_rollout_key(config):
+    # NOTE: rollouts are collected on the train env, whose agents depend on skyline. Both agents can act in the
+    # rollouts (the coordination actions hand steps to the strong one), whichever agent collects the features
+    skyline = config.general.skyline
+    weak_path = config.agents.weak if skyline else config.agents.sim_weak
+    strong_path = config.agents.strong if skyline else config.agents.weak
+    env_name = "test" if skyline else "train"
+    return {
+        "benchmark": config.general.benchmark,
+        "collect_data_agent": config.coord_policy.collect_data_agent,
+        "agents": {
+            "weak": hash_file(weak_path) if isinstance(weak_path, str) else "oracle",
+            "strong": hash_file(strong_path) if isinstance(strong_path, str) else "oracle",
+        },
+        "environment": {
+            "common": config.environment.common.as_dict(),
+            env_name: getattr(config.environment, env_name).as_dict(),
+        },
+        "coord_env": {k: v for k, v in config.coord_env.as_dict().items() if k not in EXECUTION_OPTIONS},
+        "seed": config.general.seed,
+    }
+
+
+class FeatureStore:
+    """Disk cache of feature rows (env_obs, weak_features, weak_logit) collected from rollouts.
+
+    Each entry is a directory named after the hash of its key (base_key plus the sampling arguments). It
+    holds chunked .npy files per feature key, which are loaded memory-mapped, and a meta.json. Entries are
+    written to a temporary directory that is renamed once complete, so readers never see partial entries.
+    Entries hold the keys their writer appended: "ood" entries the feature keys listed in their key, "threshold"
+    ones only weak_logit.
+
+    base_key may be a function, called on first use since it hashes the agent checkpoints.
+    """
+
+    def __init__(self, root, base_key):
+        self.root = root
+        self._base_key = base_key
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def base_key(self):
+        if callable(self._base_key):
+            self._base_key = self._base_key()
+        return self._base_key
+
+    def get_path(self, **key):
+        key = dict(self.base_key, **key)
+        key_hash = hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:24]
+        return os.path.join(self.root, key_hash)
+
+    def load(self, **key):
+        path = self.get_path(**key)
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        logging.info(f"Loaded rollout features from {path}")
+        return FeatureStoreEntry(path)
+
+    def writer(self, **key):
+        return FeatureStoreWriter(self.get_path(**key), dict(self.base_key, **key))
+
+
+class FeatureStoreEntry:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+
+    def chunks(self, feature_key):
+        num_chunks = self.meta["features"][feature_key]["chunks"]
+        return [
+            np.load(os.path.join(self.path, f"{feature_key}.{i:05d}.npy"), mmap_mode="r")
+            for i in range(num_chunks)
+        ]
+
+    def read(self, feature_key):
+        chunks = self.chunks(feature_key)
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+
+class FeatureStoreWriter:
+    def __init__(self, path, key, chunk_rows=4096):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.meta = {"key": key, "features": {}}
+        self.tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=".tmp-")
+
+    def append(self, batch):
+        """Appends the rows of batch (feature key -> array of shape (N, ...))."""
+        for feature_key, values in batch.items():
+            info = self.meta["features"].setdefault(feature_key, {"chunks": 0, "rows": 0})
+            for start in range(0, len(values), self.chunk_rows):
+                chunk = np.asarray(values[start:start + self.chunk_rows])
+                file_path = os.path.join(self.tmp_path, f"{feature_key}.{info['chunks']:05d}.npy")
+                array = np.lib.format.open_memmap(file_path, mode="w+", dtype=chunk.dtype, shape=chunk.shape)
+                array[:] = chunk
+                array.flush()
+                del array
+                info["chunks"] += 1
+                info["rows"] += len(chunk)
+
+    def commit(self):
+        with open(os.path.join(self.tmp_path, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=2, default=str)
+        try:
+            os.rename(self.tmp_path, self.path)
+            logging.info(f"Saved rollout features to {self.path}")
+        except OSError:
+            # another run stored the same entry first
+            shutil.rmtree(self.tmp_path)
+
+    def abort(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
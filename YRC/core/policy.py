@@ -2,6 +2,18 @@ import logging
 import importlib
 
 
+# observation keys read by each coordination feature type
+FEATURE_OBS_KEYS = {
+    "obs": ["env_obs"],
+    "hidden": ["weak_features"],
+    "dist": ["weak_logit"],
+    "hidden_obs": ["env_obs", "weak_features"],
+    "hidden_dist": ["weak_features", "weak_logit"],
+    "obs_dist": ["env_obs", "weak_logit"],
+    "obs_hidden_dist": ["env_obs", "weak_features", "weak_logit"],
+}
+
+
 def make(config, env):
     coord_policy_cls = getattr(
         importlib.import_module("YRC.policies"), config.coord_policy.cls
@@ -10,7 +22,19 @@ def make(config, env):
     return coord_policy
 
 
+def get_obs_keys(config):
+    coord_policy_cls = getattr(
+        importlib.import_module("YRC.policies"), config.coord_policy.cls
+    )
+    return coord_policy_cls.obs_keys(config)
+
+
 class Policy:
+    # observation keys read from CoordEnv
+    @classmethod
+    def obs_keys(cls, config):
+        return ["env_obs", "weak_features", "weak_logit"]
+
     # get logit
     def forward(self, obs):
         pass
@@ -31,6 +55,10 @@ class Policy:
     def get_hidden(self):
         pass
 
+    # get hidden features, logit and an action from a single forward pass
+    def infer(self, obs, greedy=False):
+        pass
+
     # set to training mode
     def train(self):
         pass
@@ -1,6 +1,8 @@
 import logging
+import random
 
 import re
+from functools import partial
 from lib.cliport.cliport import tasks
 from lib.cliport.cliport.environments.environment import Environment
 import YRC.envs.cliport.wrappers as wrappers
@@ -10,6 +12,21 @@ from YRC.core.configs.global_configs import get_global_variable
 
 
 def create_env(name, config):
+    num_envs = config.common.num_envs
+    if num_envs is None or num_envs == 1:
+        env = make_single_env(name, config)
+    else:
+        seed = getattr(config, name).seed
+        env_fns = [partial(make_single_env, name, config, seed * num_envs + rank) for rank in range(num_envs)]
+        env = wrappers.SubprocVecEnv(env_fns)
+    env.obs_shape = env.observation_space.shape
+    return env
+
+
+def make_single_env(name, config, seed=None):
+    # NOTE: the seed drives the level sampling of HardResetWrapper, needed when several workers run in parallel
+    if seed is not None:
+        random.seed(seed)
     task_category = {
         "color": ["assembling-kits-seq", "packing-boxes-pairs", "put-block-in-bowl", "stack-block-pyramid-seq", "separating-piles", "towers-of-hanoi-seq"],
         "object": ["packing-google-objects-seq", "packing-google-objects-group"],
@@ -32,7 +49,6 @@ def create_env(name, config):
         specific_config.num_levels,
         specific_config.distribution_mode
     )
-    env.obs_shape = env.observation_space.shape
     return env
 
 
@@ -1,23 +1,110 @@
+from collections import OrderedDict
+
 from lib.cliport.cliport.agents.transporter_lang_goal import TwoStreamClipLingUNetLatTransporterAgent
 import torch
 from YRC.core.configs.global_configs import get_global_variable
+from YRC.models.utils import THRESHOLD_METRICS, compute_uncertainty_metrics
 import numpy as np
 
 
+class LangEmbeddingCache:
+    """LRU cache of language-goal embeddings, keyed by text encoder and goal string."""
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, encoder, goal, encode_fn):
+        key = (id(encoder), goal)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        value = encode_fn(goal)
+        self.entries[key] = value
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups > 0 else 0.0
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(hit_rate, 4), "size": len(self.entries)}
+
+
+class CachedTextEncoder:
+    """Mixin of the text-encoder modules of CliportModel: encode_text goes through their lang_cache."""
+
+    def encode_text(self, goal):
+        if not isinstance(goal, str):
+            return super().encode_text(goal)
+        return self.lang_cache.get(self, goal, super().encode_text)
+
+
+_cached_encoder_classes = {}
+
+
+def cached_encoder_class(cls):
+    if cls not in _cached_encoder_classes:
+        _cached_encoder_classes[cls] = type(f"Cached{cls.__name__}", (CachedTextEncoder, cls), {})
+    return _cached_encoder_classes[cls]
+
+
 class CliportModel(TwoStreamClipLingUNetLatTransporterAgent):
     def __init__(self, name, cfg):
         super().__init__(name, cfg, train_ds=None, test_ds=None)
 
+        # language goals repeat within and across episodes, encode each one once per text encoder
+        self.lang_cache = LangEmbeddingCache()
+        self._cache_text_encoders()
+
+        # when set, get_logit returns the threshold metrics of each head instead of the flattened heatmaps
+        self.logit_summary = False
+
         dummy_image = np.ones((1, *self.in_shape), dtype=np.float32)
         dummy_info = [{"lang_goal": 'put the red block on the lightest brown block'}]
         self.to(get_global_variable("device"))
         dummy_pick_features, dummy_place_features = self.extract_features(dummy_image, dummy_info)
         self.hidden_dim = np.concatenate((dummy_pick_features[0], dummy_place_features[0]), axis=0).shape[0]
-        self.logit_dim = self.get_logit({"image": dummy_image, "info": dummy_info[0]}).shape[1]
+        self.full_logit_dim = self.get_logit({"image": dummy_image, "info": dummy_info[0]}).shape[1]
+
+    def _cache_text_encoders(self):
+        # NOTE: the text encoders are built inside the cliport agent, they are switched to a subclass whose
+        # encode_text method reads the cache
+        for module in self.modules():
+            if module is not self and hasattr(module, "encode_text") and not isinstance(module, CachedTextEncoder):
+                module.__class__ = cached_encoder_class(type(module))
+                module.lang_cache = self.lang_cache
+
+    @property
+    def logit_dim(self):
+        return 2 * len(THRESHOLD_METRICS) if self.logit_summary else self.full_logit_dim
+
+    def load(self, path):
+        super().load(path)
+        # cached embeddings were computed with the weights before loading
+        self.lang_cache.clear()
+
+    @staticmethod
+    def split_obs(obs):
+        """Yields (image, info) per env. A vectorized env gives a list of infos, a single env gives one dict."""
+        infos = obs["info"] if isinstance(obs["info"], list) else [obs["info"]]
+        return list(zip(obs["image"], infos))
 
     def get_hidden(self, obs):
-        img, info = obs["image"][0], obs["info"]
-        pick_hidden, place_hidden = super().extract_features([img], [info])
+        images, infos = zip(*self.split_obs(obs))
+        return self.get_hidden_batch(images, infos)
+
+    def get_hidden_batch(self, images, infos):
+        """Hidden features of B images and their infos, from one feature-extraction call. Returns (B, hidden_dim)."""
+        pick_hidden, place_hidden = super().extract_features(list(images), list(infos))
         pick_hidden = torch.stack(pick_hidden) if isinstance(pick_hidden, list) else pick_hidden
         place_hidden = torch.stack(place_hidden) if isinstance(place_hidden, list) else place_hidden
 
@@ -28,7 +115,29 @@ class CliportModel(TwoStreamClipLingUNetLatTransporterAgent):
         return torch.cat((pick_hidden, place_hidden), dim=-1)
 
     def get_logit(self, obs):
-        img, lang_goal = obs["image"][0], obs["info"]['lang_goal']
-        attention_logits = self.attention.get_logits(img, lang_goal)
-        transport_logits = self.transport.get_logits(img, lang_goal)
-        return torch.cat((attention_logits.flatten().unsqueeze(0), transport_logits.flatten().unsqueeze(0)), dim=-1)
+        images, infos = zip(*self.split_obs(obs))
+        return self.get_logit_per_item(images, [info["lang_goal"] for info in infos])
+
+    def get_logit_per_item(self, images, lang_goals):
+        """Flattened attention and transport logits of B images and goals. Returns (B, logit_dim).
+
+        The attention and transport streams take one image and one goal per call, so this runs one forward
+        pass per item. Only the outputs are stacked, it is not faster than calling the streams in turn.
+        """
+        attention_logits = torch.stack([self.attention.get_logits(img, goal).flatten() for img, goal in zip(images, lang_goals)])
+        transport_logits = torch.stack([self.transport.get_logits(img, goal).flatten() for img, goal in zip(images, lang_goals)])
+        if self.logit_summary:
+            # (B, 2 * len(THRESHOLD_METRICS)): attention metrics, then transport metrics
+            return torch.cat((compute_uncertainty_metrics(attention_logits), compute_uncertainty_metrics(transport_logits)), dim=-1)
+        return torch.cat((attention_logits, transport_logits), dim=-1)
+
+    def act_per_item(self, images, infos):
+        """Actions of B images and infos, one act call per item (the transport is conditioned on each item's pick)."""
+        return [self.act(img, info)[0] for img, info in zip(images, infos)]
+
+    def infer(self, obs):
+        images, infos = zip(*self.split_obs(obs))
+        hidden = self.get_hidden_batch(images, infos)
+        logit = self.get_logit_per_item(images, [info["lang_goal"] for info in infos])
+        actions = self.act_per_item(images, infos)
+        return hidden, logit, actions
@@ -1,6 +1,17 @@
 import numpy as np
 
 from YRC.core.policy import Policy
+from YRC.core.environment import ACTION_PAD
+from YRC.envs.cliport.wrappers import SubprocVecEnv
+
+
+def stack_actions(actions):
+    """Stacks (1, D) action rows of a batch, padding the narrower ones with ACTION_PAD (pick/place are optional)."""
+    width = max(action.shape[1] for action in actions)
+    stacked = np.full((len(actions), width), ACTION_PAD, dtype=object)
+    for i, action in enumerate(actions):
+        stacked[i, :action.shape[1]] = action[0]
+    return stacked
 
 
 class CliportPolicy(Policy):
@@ -15,22 +26,33 @@ class CliportPolicy(Policy):
         return dist
 
     def act(self, obs, base_env=None, greedy=False):
-        img = obs['image'][0]
-        info = obs['info']
-        action, _, _ = self.model.act(img, info)
-        if action is None:
-            np_action = np.array([None] * 14)[np.newaxis, :]
-        else:
-            np_action = self.flatten(action)
-        return np_action
+        images, infos = zip(*self.model.split_obs(obs))
+        actions = self.model.act_per_item(images, infos)
+        return stack_actions([self.to_np_action(action) for action in actions])
 
     def get_hidden(self, obs):
         return self.model.get_hidden(obs)
 
+    def infer(self, obs, greedy=False):
+        hidden, logit, actions = self.model.infer(obs)
+        return hidden, logit, stack_actions([self.to_np_action(action) for action in actions])
+
+    def stats(self):
+        return {"lang_cache": self.model.lang_cache.stats()}
+
+    def set_logit_summary(self, logit_summary):
+        self.model.logit_summary = logit_summary
+
     @property
     def hidden_dim(self):
         return self.model.hidden_dim
 
+    @classmethod
+    def to_np_action(cls, action):
+        if action is None:
+            return np.array([None] * 14)[np.newaxis, :]
+        return cls.flatten(action)
+
     @staticmethod
     def flatten(action):
         arrays = []
@@ -49,6 +71,9 @@ class CliportPolicyOracle(Policy):
         super().__init__()
 
     def act(self, obs, base_env=None, greedy=False):
+        if isinstance(base_env, SubprocVecEnv):
+            # the oracle needs the simulator state, so it runs inside each env worker
+            return base_env.oracle_act(obs)
         img, info = obs['image'], obs['info']
         default_action = np.full((1, 14), None, dtype=object)
         if not base_env.task.goals:
@@ -1,10 +1,14 @@
 import random
+import logging
+import multiprocessing as mp
 
 from lib.cliport.cliport.utils import utils
 import gym
 from gym import spaces
 import numpy as np
 
+from YRC.core.environment import StepInfo, strip_action_pad
+
 
 class HardResetWrapper(gym.Wrapper):
     def __init__(self, env, start_level, num_levels, distribution_mode):
@@ -43,9 +47,9 @@ class HardResetWrapper(gym.Wrapper):
             _, reward, _, info = self.env.step(action)
             obs = self.reset()
             done = True
-            return obs, np.array([reward]), np.array([done]), [info]
+            return obs, np.array([reward]), np.array([done]), self._wrap_info(reward, done, info)
 
-        np_action = np_action[0]
+        np_action = strip_action_pad(np_action[0])
         pose0_pos = np_action[:3]
         pose0_ori = np_action[3:7]
         pose1_pos = np_action[7:10]
@@ -63,4 +67,125 @@ class HardResetWrapper(gym.Wrapper):
         obs = utils.get_image(obs)
         self.env_step += 1
         obs = np.expand_dims(obs, axis=0)
-        return {"image": obs, "info": self.info}, np.array([reward]), np.array([done]), [info]
+        return {"image": obs, "info": self.info}, np.array([reward]), np.array([done]), self._wrap_info(reward, done, info)
+
+    @staticmethod
+    def _wrap_info(reward, done, info):
+        return StepInfo({"env_reward": np.array([reward]), "done": np.array([done])}, [info])
+
+
+class CloudpickleWrapper(object):
+    """
+    Uses cloudpickle to serialize contents (otherwise multiprocessing tries to use pickle)
+    """
+
+    def __init__(self, x):
+        self.x = x
+
+    def __getstate__(self):
+        import cloudpickle
+
+        return cloudpickle.dumps(self.x)
+
+    def __setstate__(self, ob):
+        import pickle
+
+        self.x = pickle.loads(ob)
+
+
+def worker(remote, parent_remote, env_fn_wrapper):
+    parent_remote.close()
+    env = env_fn_wrapper.x()
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                remote.send(env.step(data))
+            elif cmd == "reset":
+                remote.send(env.reset())
+            elif cmd == "oracle_act":
+                from YRC.envs.cliport.policies import CliportPolicyOracle
+                remote.send(CliportPolicyOracle().act(data, env))
+            elif cmd == "get_spaces":
+                remote.send((env.observation_space, env.action_space))
+            elif cmd == "set_rng_state":
+                random.setstate(data)
+            elif cmd == "close":
+                # the level sampling state, restored when the worker is restarted
+                remote.send(random.getstate())
+                remote.close()
+                break
+            else:
+                raise NotImplementedError(f"Unrecognized command: {cmd}")
+    except KeyboardInterrupt:
+        logging.info("SubprocVecEnv worker: got KeyboardInterrupt")
+
+
+class SubprocVecEnv:
+    """
+    Runs one cliport (pybullet) environment per subprocess and batches their observations.
+    Observations are {"image": (num_envs, H, W, C), "info": [info of each env]}.
+    """
+
+    def __init__(self, env_fns, context="spawn"):
+        self.env_fns = env_fns
+        self.num_envs = len(env_fns)
+        self.ctx = mp.get_context(context)
+        self.rng_states = None
+        self._start()
+
+        self.remotes[0].send(("get_spaces", None))
+        self.observation_space, self.action_space = self.remotes[0].recv()
+
+    def _start(self):
+        self.closed = False
+        self.remotes, self.work_remotes = zip(*[self.ctx.Pipe() for _ in range(self.num_envs)])
+        self.ps = [
+            self.ctx.Process(target=worker, args=(work_remote, remote, CloudpickleWrapper(env_fn)))
+            for (work_remote, remote, env_fn) in zip(self.work_remotes, self.remotes, self.env_fns)
+        ]
+        for p in self.ps:
+            p.daemon = True  # if the main process crashes, we should not cause things to hang
+            p.start()
+        for remote in self.work_remotes:
+            remote.close()
+        if self.rng_states is not None:
+            # NOTE: restarted workers continue their level sampling instead of replaying it from the seed
+            for remote, state in zip(self.remotes, self.rng_states):
+                remote.send(("set_rng_state", state))
+
+    def reset(self):
+        # NOTE: the evaluator closes envs after each evaluation, workers are restarted on the next reset
+        if self.closed:
+            self._start()
+        for remote in self.remotes:
+            remote.send(("reset", None))
+        return self._merge_obs([remote.recv() for remote in self.remotes])
+
+    def step(self, actions):
+        for i, remote in enumerate(self.remotes):
+            remote.send(("step", actions[i:i + 1]))
+        results = [remote.recv() for remote in self.remotes]
+        obs, rews, dones, infos = zip(*results)
+        columns = {k: np.concatenate([info[k] for info in infos]) for k in infos[0].columns}
+        env_info = [item for info in infos for item in info.env_info]
+        return self._merge_obs(obs), np.concatenate(rews), np.concatenate(dones), StepInfo(columns, env_info)
+
+    def oracle_act(self, obs):
+        for i, remote in enumerate(self.remotes):
+            remote.send(("oracle_act", {"image": obs["image"][i:i + 1], "info": obs["info"][i]}))
+        return np.concatenate([remote.recv() for remote in self.remotes])
+
+    @staticmethod
+    def _merge_obs(obs):
+        return {"image": np.concatenate([o["image"] for o in obs]), "info": [o["info"] for o in obs]}
+
+    def close(self):
+        if self.closed:
+            return
+        for remote in self.remotes:
+            remote.send(("close", None))
+        self.rng_states = [remote.recv() for remote in self.remotes]
+        for p in self.ps:
+            p.join()
+        self.closed = True
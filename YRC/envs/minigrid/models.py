@@ -86,6 +86,23 @@ class MinigridModel(nn.Module):
         logit = self.actor(embedding)
         return logit
 
+    def infer(self, obs, memory):
+        """Compute hidden features, logits and the recurrent action distribution in one pass."""
+        x = obs.image.transpose(1, 3).transpose(2, 3).to(self.device)
+        x = self.image_conv(x)
+        x = x.reshape(x.shape[0], -1)
+        embed_text = self._get_embed_text(obs.text)
+
+        hidden = torch.cat((x, embed_text), dim=1)
+        logit = self.actor(hidden)
+
+        rnn_hidden = (memory[:, :self.semi_memory_size], memory[:, self.semi_memory_size:])
+        rnn_hidden = self.memory_rnn(x, rnn_hidden)
+        memory = torch.cat(rnn_hidden, dim=1)
+        embedding = torch.cat((rnn_hidden[0], embed_text), dim=1)
+        dist = Categorical(logits=F.log_softmax(self.actor(embedding), dim=1))
+        return hidden, logit, dist, memory
+
     def _get_embed_text(self, text):
         text = text.to(self.device)
         _, hidden = self.text_rnn(self.word_embedding(text))
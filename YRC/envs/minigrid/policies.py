@@ -29,6 +29,16 @@ class MinigridPolicy(Policy):
         obs = self.model.preprocess_obs(obs)
         return self.model.get_hidden(obs)
 
+    @torch.no_grad()
+    def infer(self, obs, greedy=False):
+        obs = self.model.preprocess_obs(obs)
+        hidden, logit, dist, self.memory = self.model.infer(obs, self.memory)
+        if greedy:
+            action = dist.probs.argmax(dim=-1)
+        else:
+            action = dist.sample()
+        return hidden, logit, action.cpu().numpy()
+
     @property
     def hidden_dim(self):
         return self.model.hidden_dim
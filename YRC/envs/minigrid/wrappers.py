@@ -1,6 +1,8 @@
 import gymnasium as gym
 from gymnasium.vector.vector_env import VectorEnv
 
+from YRC.core.environment import StepInfo
+
 
 class HardResetWrapper(VectorEnv):
     def __init__(self, env):
@@ -18,5 +20,5 @@ class HardResetWrapper(VectorEnv):
     def step(self, actions):
         obs, reward, termination, truncation, info = self.env.step(actions)
         done = termination | truncation  # wrapper for gymnasium to older gym
-        info = [{"env_reward": r} for r in reward]
+        info = StepInfo({"env_reward": reward, "done": done})
         return obs, reward, done, info
@@ -36,6 +36,8 @@ def create_env(name, config):
     # NOTE: this must be done last
     env = wrappers.HardResetWrapper(env)
     env.obs_shape = env.observation_space.shape
+    # observations are 8-bit frames divided by obs_scale (ScaledFloatFrame)
+    env.obs_scale = 255.0
     return env
 
 
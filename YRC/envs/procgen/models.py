@@ -36,3 +36,8 @@ class ProcgenModel(nn.Module):
         hidden = self.get_hidden(obs)
         logit = self.fc_policy(hidden)
         return logit
+
+    def infer(self, obs):
+        hidden = self.get_hidden(obs)
+        logit = self.fc_policy(hidden)
+        return hidden, logit
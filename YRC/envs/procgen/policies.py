@@ -1,3 +1,7 @@
+import torch
+import torch.nn.functional as F
+from torch.distributions.categorical import Categorical
+
 from YRC.core.policy import Policy
 
 
@@ -23,6 +27,15 @@ class ProcgenPolicy(Policy):
     def get_hidden(self, obs):
         return self.model.get_hidden(obs)
 
+    @torch.no_grad()
+    def infer(self, obs, greedy=False):
+        hidden, logit = self.model.infer(obs)
+        if greedy:
+            action = logit.argmax(dim=-1)
+        else:
+            action = Categorical(logits=F.log_softmax(logit, dim=1)).sample()
+        return hidden, logit, action.cpu().numpy()
+
     @property
     def hidden_dim(self):
         return self.model.hidden_dim
@@ -6,6 +6,8 @@ import gym
 import numpy as np
 from gym import spaces
 
+from YRC.core.environment import StepInfo
+
 """
 Copy-pasted from OpenAI to obviate dependency on Baselines. Required for vectorized environments.
 """
@@ -340,11 +342,12 @@ class VecNormalize(VecEnvWrapper):
         self.ret = np.zeros(self.num_envs)
         self.gamma = gamma
         self.epsilon = epsilon
+        # unnormalized rewards of the last step
+        self.env_reward = np.zeros(self.num_envs)
 
     def step_wait(self):
         obs, rews, news, infos = self.venv.step_wait()
-        for i in range(len(infos)):
-            infos[i]["env_reward"] = rews[i]
+        self.env_reward = rews
         self.ret = self.ret * self.gamma + rews
         obs = self._obfilt(obs)
         if self.ret_rms:
@@ -415,7 +418,10 @@ class ScaledFloatFrame(VecEnvWrapper):
 # NOTE: this only works with Procgen, assuming venv is a baselines environment
 class HardResetWrapper(VecEnvWrapper):
     def step_wait(self):
-        return self.venv.step_wait()
+        obs, rews, dones, infos = self.venv.step_wait()
+        # VecNormalize (if present) keeps the unnormalized rewards
+        env_reward = getattr(self.venv, "env_reward", rews)
+        return obs, rews, dones, StepInfo({"env_reward": env_reward, "done": dones}, infos)
 
     def reset(self):
         obs, _, _, _ = self.venv.step(np.array([-1] * self.venv.num_envs))
@@ -3,6 +3,7 @@ import torch.nn as nn
 
 from YRC.models.utils import orthogonal_init, ImpalaModel
 from YRC.core.configs.global_configs import get_global_variable
+from YRC.core.policy import FEATURE_OBS_KEYS
 
 
 class ImpalaCoordPolicyModel(nn.Module):
@@ -11,6 +12,7 @@ class ImpalaCoordPolicyModel(nn.Module):
 
         self.device = get_global_variable("device")
         self.embedder = ImpalaModel(coord_env.base_env.obs_shape)
+        self.obs_scale = getattr(coord_env.base_env, "obs_scale", None)
 
         self.feature_type = config.coord_policy.feature_type
         if self.feature_type == "obs":
@@ -34,33 +36,32 @@ class ImpalaCoordPolicyModel(nn.Module):
             nn.Linear(self.hidden_dim, coord_env.action_space.n), gain=0.01
         )
 
-    def forward(self, obs, ret_hidden=False):
-        env_obs = obs['env_obs']['image'] if isinstance(obs['env_obs'], dict) else obs['env_obs']
-        if not torch.is_tensor(env_obs):
-            env_obs = torch.from_numpy(env_obs).float().to(self.device)
-        weak_features = obs["weak_features"]
-        if not torch.is_tensor(weak_features):
-            weak_features = torch.from_numpy(weak_features).float().to(self.device)
-        weak_logit = obs["weak_logit"]
-        if not torch.is_tensor(weak_logit):
-            weak_logit = torch.from_numpy(weak_logit).float().to(self.device)
+    @property
+    def obs_keys(self):
+        return FEATURE_OBS_KEYS[self.feature_type]
+
+    def _get_input(self, obs, key):
+        x = obs[key]
+        if isinstance(x, dict):
+            x = x['image']
+        if not torch.is_tensor(x):
+            x = torch.from_numpy(x).float().to(self.device)
+        elif x.dtype == torch.uint8:
+            # uint8 frames from the PPO rollout buffer
+            x = x.float() / self.obs_scale
+        return x
 
-        if self.feature_type == "obs":
-            hidden = self.embedder(env_obs)
-        elif self.feature_type == "hidden":
-            hidden = weak_features
-        elif self.feature_type == "hidden_obs":
-            hidden = torch.cat([self.embedder(env_obs), weak_features], dim=-1)
-        elif self.feature_type == "dist":
-            hidden = weak_logit.softmax(dim=-1)
-        elif self.feature_type == "hidden_dist":
-            hidden = torch.cat([weak_features, weak_logit.softmax(dim=-1)], dim=-1)
-        elif self.feature_type == "obs_dist":
-            hidden = torch.cat([self.embedder(env_obs), weak_logit.softmax(dim=-1)], dim=-1)
-        elif self.feature_type == "obs_hidden_dist":
-            hidden = torch.cat([self.embedder(env_obs), weak_features, weak_logit.softmax(dim=-1)], dim=-1)
-        else:
-            raise NotImplementedError
+    def forward(self, obs, ret_hidden=False):
+        # NOTE: only the keys used by the feature type are read, CoordEnv may omit the others
+        features = []
+        for key in self.obs_keys:
+            x = self._get_input(obs, key)
+            if key == "env_obs":
+                x = self.embedder(x)
+            elif key == "weak_logit":
+                x = x.softmax(dim=-1)
+            features.append(x)
+        hidden = torch.cat(features, dim=-1) if len(features) > 1 else features[0]
 
         logit = self.fc_policy(hidden)
 
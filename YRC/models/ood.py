@@ -0,0 +1,134 @@
+import numpy as np
+import torch
+
+from YRC.core.policy import FEATURE_OBS_KEYS
+
+
+class ClosedFormDetector:
+    """OOD detector fitted without gradient training, with the fit / decision_function / threshold_ contract of pyod.
+
+    Scores are higher for more OOD samples. decision_scores_ are the scores of the threshold samples, and
+    threshold_ is their (1 - contamination) quantile.
+    """
+
+    def __init__(self, feature_type, contamination=0.1, device=None):
+        self.feature_type = feature_type
+        self.contamination = contamination
+        self.device = device
+        self.decision_scores_ = None
+        self.threshold_ = None
+
+    def _to_parts(self, X):
+        parts = X if isinstance(X, (list, tuple)) else [X]
+        keys = FEATURE_OBS_KEYS[self.feature_type]
+        assert len(parts) == len(keys)
+        return {key: torch.as_tensor(part, device=self.device).float().flatten(1) for key, part in zip(keys, parts)}
+
+    def fit(self, X, X_threshold=None, labels=None):
+        """Fits on X, then sets threshold_ from the scores of X_threshold. labels are optional class labels of X."""
+        self._fit(self._to_parts(X), labels)
+        self.decision_scores_ = self.decision_function(X_threshold if X_threshold is not None else X)
+        self.threshold_ = np.percentile(self.decision_scores_, 100 * (1 - self.contamination))
+        return self
+
+    @torch.no_grad()
+    def decision_function(self, X):
+        return self.score(X).cpu().numpy()
+
+    @torch.no_grad()
+    def score(self, X):
+        """Same as decision_function, but returns a tensor on the detector device."""
+        return self._score(self._to_parts(X))
+
+    def state_dict(self):
+        """Returns the fitted tensors (attributes ending with an underscore), without the threshold samples."""
+        return {key: value for key, value in vars(self).items() if key.endswith("_") and torch.is_tensor(value)}
+
+    def load_state_dict(self, state_dict):
+        for key, value in state_dict.items():
+            setattr(self, key, value.to(self.device) if self.device is not None else value)
+
+    def _fit(self, parts, labels):
+        raise NotImplementedError
+
+    def _score(self, parts):
+        raise NotImplementedError
+
+
+class MahalanobisDetector(ClosedFormDetector):
+    """Class-conditional Gaussians with a shared covariance over the weak agent features (Lee et al., 2018).
+
+    The classes are given to fit as labels, the greedy actions of the weak agent (see OODPolicy.fit_detector).
+    The features are the hidden features of the weak agent, or its logits for dist (with hidden_dist the logits
+    only serve as labels). The score is the Mahalanobis distance to the closest class mean.
+    """
+
+    FEATURE_TYPES = ["hidden", "dist", "hidden_dist"]
+
+    def __init__(self, feature_type, contamination=0.1, reg=1e-3, device=None):
+        assert feature_type in self.FEATURE_TYPES, "Mahalanobis needs hidden or dist features!"
+        super().__init__(feature_type, contamination, device)
+        self.reg = reg
+
+    @staticmethod
+    def _features(parts):
+        return parts["weak_features"] if "weak_features" in parts else parts["weak_logit"]
+
+    @torch.no_grad()
+    def _fit(self, parts, labels):
+        features = self._features(parts)
+        if labels is None:
+            labels = torch.zeros(len(features), dtype=torch.long)
+        labels = torch.as_tensor(labels, device=features.device)
+        classes = labels.unique()
+        self.means_ = torch.stack([features[labels == c].mean(dim=0) for c in classes])
+        centered = features - self.means_[torch.searchsorted(classes, labels)]
+        cov = centered.T @ centered / len(features)
+        # NOTE: ReLU features are often rank-deficient, shrink towards reg times the mean eigenvalue
+        cov += self.reg * cov.trace() / cov.shape[0] * torch.eye(cov.shape[0], device=cov.device)
+        self.precision_ = torch.linalg.pinv(cov, hermitian=True)
+        # (x - m)^T P (x - m) = x^T P x - 2 x^T P m + m^T P m
+        self.means_precision_ = self.means_ @ self.precision_
+        self.means_norm_ = (self.means_precision_ * self.means_).sum(dim=-1)
+
+    def _score(self, parts):
+        features = self._features(parts)
+        features_precision = features @ self.precision_
+        dist = (
+            (features_precision * features).sum(dim=-1, keepdim=True)
+            - 2 * features @ self.means_precision_.T
+            + self.means_norm_
+        )
+        return dist.min(dim=-1)[0].clamp(min=0).sqrt()
+
+
+class KNNDetector(ClosedFormDetector):
+    """Distance to the n_neighbors-th nearest neighbour in a bank of in-distribution features.
+
+    All feature keys are flattened and concatenated. Distances are computed by blocks of block_size samples,
+    one matmul against the whole bank per block.
+    """
+
+    def __init__(self, feature_type, n_neighbors=5, contamination=0.1, block_size=1024, device=None):
+        super().__init__(feature_type, contamination, device)
+        self.n_neighbors = n_neighbors
+        self.block_size = block_size
+
+    @staticmethod
+    def _concat(parts):
+        return torch.cat(list(parts.values()), dim=-1)
+
+    @torch.no_grad()
+    def _fit(self, parts, labels):
+        self.bank_ = self._concat(parts)
+        self.bank_norm_ = (self.bank_ ** 2).sum(dim=-1)
+
+    def _score(self, parts):
+        features = self._concat(parts)
+        k = min(self.n_neighbors, len(self.bank_))
+        scores = []
+        for start in range(0, len(features), self.block_size):
+            block = features[start:start + self.block_size]
+            dist = (block ** 2).sum(dim=-1, keepdim=True) - 2 * block @ self.bank_.T + self.bank_norm_
+            scores.append(dist.topk(k, dim=-1, largest=False)[0][:, -1])
+        return torch.cat(scores).clamp(min=0).sqrt()
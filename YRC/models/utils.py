@@ -25,6 +25,31 @@ def xavier_uniform_init(module, gain=1.0):
     return module
 
 
+# NOTE: higher = more certain for all metrics
+THRESHOLD_METRICS = ["max_logit", "max_prob", "margin", "neg_entropy", "neg_energy"]
+
+
+def compute_uncertainty_metrics(logit):
+    """Computes every metric of THRESHOLD_METRICS from logit (..., K), stacked along a new last dimension."""
+    log_prob = logit.log_softmax(dim=-1)
+    prob = log_prob.exp()
+
+    max_logit = logit.max(dim=-1)[0]
+    if logit.size(-1) > 1:
+        top2 = prob.topk(2, dim=-1)[0]
+        max_prob = top2[..., 0]
+        margin = top2[..., 0] - top2[..., 1]
+    else:
+        # Binary case when logit has shape (..., 1)
+        max_prob = prob[..., 0]
+        margin = logit.sigmoid()[..., 0]
+    # same clamping as Categorical.entropy so that zero probabilities contribute 0
+    neg_entropy = (prob * log_prob.clamp(min=torch.finfo(log_prob.dtype).min)).sum(dim=-1)
+    neg_energy = logit.logsumexp(dim=-1)
+
+    return torch.stack([max_logit, max_prob, margin, neg_entropy, neg_energy], dim=-1)
+
+
 class ImpalaModel(nn.Module):
     def __init__(self, input_size, scale=1):
         super(ImpalaModel, self).__init__()
@@ -8,7 +8,7 @@ import torch.optim as optim
 
 import os
 
-from YRC.core.policy import Policy
+from YRC.core.policy import Policy, FEATURE_OBS_KEYS
 import YRC.models as models
 from YRC.core.configs.global_configs import get_global_variable
 from YRC.core.configs.utils import config_logging
@@ -23,6 +23,10 @@ class BasePolicy(Policy):
         # TODO: not sure write optim.Adam messes up logging, need to reconfigure here
         config_logging(get_global_variable("log_file"))
 
+    @classmethod
+    def obs_keys(cls, config):
+        return FEATURE_OBS_KEYS[config.coord_policy.feature_type]
+
     def train(self):
         self.model.train()
 
@@ -71,13 +75,17 @@ class AlwaysPolicy(Policy):
         assert agent in ["weak", "strong"], f"Unrecognized agent: {agent}!"
         self.choice = env.WEAK if agent == "weak" else env.STRONG
 
+    @classmethod
+    def obs_keys(cls, config):
+        return ["env_obs"]
+
     def act(self, obs, greedy=False):
         benchmark = get_global_variable("benchmark")
         env_obs = obs["env_obs"]
 
         if isinstance(env_obs, dict):
             if benchmark == "cliport":
-                action_shape = (1,)
+                action_shape = (env_obs["image"].shape[0],)
             elif benchmark == "minigrid":
                 action_shape = (env_obs["direction"].shape[0],)
         else:
@@ -92,13 +100,17 @@ class RandomPolicy(Policy):
         self.prob = 0.5
         self.device = get_global_variable("device")
 
+    @classmethod
+    def obs_keys(cls, config):
+        return ["env_obs"]
+
     def act(self, obs, greedy=False):
         benchmark = get_global_variable("benchmark")
         env_obs = obs["env_obs"]
 
         if isinstance(env_obs, dict):
             if benchmark == "cliport":
-                action_shape = (1,)
+                action_shape = (env_obs["image"].shape[0],)
             elif benchmark == "minigrid":
                 action_shape = (env_obs["direction"].shape[0],)
         else:
@@ -1,12 +1,15 @@
 import os
+import zipfile
 import numpy as np
-from copy import deepcopy as dc
+from copy import copy, deepcopy as dc
 
 import torch
 import logging
 from torch.distributions.categorical import Categorical
-from YRC.core import Policy
-from lib.pyod.pyod.models import deep_svdd
+from YRC.core import Policy, feature_store
+from YRC.core.policy import FEATURE_OBS_KEYS
+from YRC.policies.utils import ReservoirBuffer
+from YRC.models.ood import ClosedFormDetector, MahalanobisDetector, KNNDetector
 from joblib import dump, load
 from YRC.core.configs.global_configs import get_global_variable
 
@@ -14,6 +17,7 @@ from YRC.core.configs.global_configs import get_global_variable
 class OODPolicy(Policy):
     def __init__(self, config, env):
         self.args = config.coord_policy
+        self.collect_data_agent = config.coord_policy.collect_data_agent
         if config.coord_policy.collect_data_agent == "weak":
             self.agent = env.weak_agent
         elif config.coord_policy.collect_data_agent == "strong":
@@ -21,128 +25,179 @@ class OODPolicy(Policy):
         self.params = {"threshold": 0.0, "explore_temp": 1.0}
         self.clf = None
         self.clf_name = None
+        self.clf_config = None
+        self.device_scoring = None
         self.device = get_global_variable("device")
         self.feature_type = config.coord_policy.feature_type
+        self.feature_store = feature_store.make(config)
 
-    def gather_rollouts(self, env, num_rollouts):
+    @classmethod
+    def obs_keys(cls, config):
+        # NOTE: with feature_types, one rollout samples the features of every feature type
+        keys = ["env_obs"]
+        for feature_type in config.algorithm.feature_types or [config.coord_policy.feature_type]:
+            keys += [key for key in FEATURE_OBS_KEYS[feature_type] if key not in keys]
+        # rollouts sample actions from the weak logits, which also label the classes of Mahalanobis
+        needs_logit = config.coord_policy.collect_data_agent == "weak" or config.coord_policy.method == "Mahalanobis"
+        if needs_logit and "weak_logit" not in keys:
+            keys.append("weak_logit")
+        return keys
+
+    def fit_keys(self, feature_type=None):
+        """Feature keys the detector is fitted on, with the weak logits that label the classes of Mahalanobis."""
+        keys = list(FEATURE_OBS_KEYS[feature_type or self.feature_type])
+        if self.args.method == "Mahalanobis" and "weak_logit" not in keys:
+            keys.append("weak_logit")
+        return keys
+
+    def gather_rollouts(self, env, num_rollouts, num_samples, name="fit"):
+        """Reservoir-samples num_samples rows of the fit_keys features from num_rollouts episodes.
+
+        Returns a dict with the row-aligned samples of each key, for fit_detector. With a feature store, the
+        samples are loaded from (or saved to) the entry of name.
+        """
+        return self.gather_features(env, num_rollouts, num_samples, self.fit_keys(), name)
+
+    def select_features(self, features, feature_type=None):
+        observations = [features[key] for key in FEATURE_OBS_KEYS[feature_type or self.feature_type]]
+        return observations[0] if len(observations) == 1 else observations
+
+    def gather_features(self, env, num_rollouts, num_samples, keys, name="fit"):
+        """Same as gather_rollouts, for the feature keys in keys."""
         assert num_rollouts % env.num_envs == 0
-        observations = []
+        store_key = {
+            "kind": "ood",
+            "name": name,
+            "num_rollouts": num_rollouts,
+            "num_samples": num_samples,
+            "keys": list(keys),
+            "explore_temp": self.params["explore_temp"],
+        }
+        entry = self.feature_store.load(**store_key) if self.feature_store is not None else None
+        if entry is not None:
+            return {key: self.to_tensor(np.asarray(entry.read(key))) for key in keys}
+
+        # NOTE: only the requested keys are buffered, so that env_obs is not kept for hidden or dist detectors
+        buffer = ReservoirBuffer(num_samples)
         for i in range(num_rollouts // env.num_envs):
-            observations.extend(self._rollout_once(env))
-        if self.feature_type in ["hidden_obs", "hidden_dist", "obs_dist"]:
-            feature_tensors = [[], []]
-            for i, tensor in enumerate(observations):
-                if isinstance(tensor, dict):
-                    tensor = tensor["image"]
-                feature_tensors[i % 2].append(tensor)
-            observations = [torch.cat(tensors, dim=0) for tensors in feature_tensors]
-        elif self.feature_type in ["obs_hidden_dist"]:
-            feature_tensors = [[], [], []]
-            for i, tensor in enumerate(observations):
-                feature_tensors[i % 3].append(tensor)
-            if get_global_variable("benchmark") == "procgen":
-                observations = [torch.cat(tensors, dim=0) for tensors in feature_tensors]
-            elif get_global_variable("benchmark") == "minigrid":
-                observations = []
-                for tensors in feature_tensors:
-                    if isinstance(tensors[0], dict):
-                        obs_dict = {}
-                        for tensor_dict in tensors:
-                            for k, v in tensor_dict.items():
-                                obs_dict.setdefault(k, []).extend(v)
-                        for v in obs_dict.values():
-                            observations.append(v if isinstance(v[0], str) else torch.stack(v, dim=0))
-                    else:
-                        observations.append(torch.cat(tensors, dim=0))
-        else:
-            if get_global_variable("benchmark") == "minigrid" and self.feature_type not in ["hidden", "dist", "hidden_dist"]:
-                observations = torch.cat(observations[1::3], dim=0)
-            else:
-                observations = torch.stack(observations)
-        return observations
+            self._rollout_once(env, buffer, keys)
+        logging.info(f"Sampled {len(buffer)} of {buffer.num_seen} feature rows")
+
+        if self.feature_store is not None:
+            writer = self.feature_store.writer(**store_key)
+            writer.append({key: buffer.get(key).numpy() for key in keys})
+            writer.commit()
+
+        return {key: buffer.get(key).to(self.device) for key in keys}
+
+    def for_feature_type(self, feature_type):
+        """Returns a policy with the same agent but its own (uninitialized) detector for feature_type."""
+        policy = copy(self)
+        policy.feature_type = feature_type
+        policy.params = dc(self.params)
+        policy.clf = None
+        policy.clf_name = None
+        policy.clf_config = None
+        policy.device_scoring = None
+        return policy
 
-    def maybe_convert_to_tensor(self, features):
-        """Converts features to tensors if they are not already tensors."""
-        if isinstance(features, list):  # Handle lists of features (e.g., for concatenation)
-            return [self.to_tensor(f) if not torch.is_tensor(f) else f for f in features]
-        return self.to_tensor(features) if not torch.is_tensor(features) else features
+    def supports_feature_type(self, feature_type):
+        if self.args.method == "Mahalanobis":
+            return feature_type in MahalanobisDetector.FEATURE_TYPES
+        return True
 
-    def _rollout_once(self, env):
+    def _get_feature(self, obs, key):
+        feature = obs[key]
+        # NOTE: only the image of dict observations (cliport, minigrid) is used, as in act
+        if key == "env_obs" and isinstance(feature, dict):
+            feature = feature["image"]
+        return self.to_tensor(feature)
+
+    def _rollout_once(self, env, buffer, keys):
         def sample_action(logit):
             """Samples an action using a categorical distribution with exploration temperature."""
             dist = Categorical(logits=logit / self.params["explore_temp"])
             return dist.sample().cpu().numpy()
 
-        def get_features(obs, feature_type):
-            """Retrieves features based on the specified feature type."""
-            feature_map = {
-                "obs": lambda obs: obs["env_obs"]["image"] if get_global_variable("benchmark") == "cliport" else obs["env_obs"],
-                "hidden": lambda obs: obs["weak_features"],
-                "hidden_obs": lambda obs: [obs["env_obs"]["image"], obs["weak_features"]] if get_global_variable("benchmark") == "cliport" else [obs["env_obs"], obs["weak_features"]],
-                "dist": lambda obs: obs["weak_logit"],
-                "hidden_dist": lambda obs: [obs["weak_features"], obs["weak_logit"]],
-                "obs_dist": lambda obs: [obs["env_obs"]["image"], obs["weak_logit"]] if get_global_variable("benchmark") == "cliport" else [obs["env_obs"], obs["weak_logit"]],
-                "obs_hidden_dist": lambda obs: [obs["env_obs"]["image"], obs["weak_features"], obs["weak_logit"]] if get_global_variable("benchmark") == "cliport" else [obs["env_obs"], obs["weak_features"], obs["weak_logit"]]
-            }
-            return feature_map[feature_type](obs)
-
         agent = self.agent
         agent.eval()
         obs = env.reset()
         has_done = np.array([False] * env.num_envs)
-        observations = []
 
         while not has_done.all():
-            logit = agent.forward(obs["env_obs"])
-
-            if get_global_variable("benchmark") == "cliport":
-                obs_features = get_features(obs, self.feature_type)
-                obs_features = self.maybe_convert_to_tensor(obs_features)
-                observations.extend(obs_features)
+            if self.collect_data_agent == "weak":
+                # NOTE: CoordEnv already ran the weak agent on this observation
+                logit = self.to_tensor(obs["weak_logit"])
             else:
-                for i in range(env.num_envs):
-                    if not has_done[i]:
-                        obs_features = get_features(obs, self.feature_type)
-                        if np.random.rand() < 0.005:  # Randomly sample for memory efficiency
-                            obs_features = self.maybe_convert_to_tensor(obs_features)
-                            if isinstance(obs_features, dict):
-                                observations.extend(v for k, v in obs_features.items())
-                            else:
-                                observations.extend(obs_features)
+                logit = agent.forward(obs["env_obs"])
+            buffer.add({key: self._get_feature(obs, key) for key in keys}, ~has_done)
 
             action = sample_action(logit)
             obs, reward, done, info = env.step(action)
             has_done |= done
 
-        return observations
-
     def update_params(self, params):
         self.params = dc(params)
+        # NOTE: act compares scores to the detector threshold, which is also what save_model stores. Before
+        # this was synced, candidate thresholds never reached act: every sweep candidate behaved like the
+        # contamination threshold fitted by the detector, so sweeps from older runs are not comparable
+        if self.clf is not None and "threshold" in self.params:
+            self.clf.threshold_ = self.params["threshold"]
 
     def act(self, obs, greedy=False):
-        keys = {
-            "obs": ["env_obs"],
-            "hidden": ["weak_features"],
-            "dist": ["weak_logit"],
-            "hidden_obs": ["env_obs", "weak_features"],
-            "hidden_dist": ["weak_features", "weak_logit"],
-            "obs_dist": ["env_obs", "weak_logit"],
-            "obs_hidden_dist": ["env_obs", "weak_features", "weak_logit"],
-        }[self.feature_type]
-
-        if get_global_variable("benchmark") in ["cliport", "minigrid"]:
-            observation = [self.to_tensor(obs[key]["image"] if key == "env_obs" else self.to_tensor(obs[key])) for key in keys]
-        else:
-            observation = [self.to_tensor(obs[key]) for key in keys]
-
-        if self.feature_type in ["obs", "hidden", "dist"]:
+        observation = [self._get_feature(obs, key) for key in FEATURE_OBS_KEYS[self.feature_type]]
+        if len(observation) == 1:
             observation = observation[0]
-        score = self.clf.decision_function(observation)
+        score = self._score(observation)
+
+        # NOTE: the batch is scored and thresholded on device, only the action is copied to the host
+        action = (score >= self.clf.threshold_).long()
+        return action.cpu().numpy()
+
+    @torch.no_grad()
+    def _score(self, observation):
+        if isinstance(self.clf, ClosedFormDetector):
+            return self.clf.score(observation)
+        if self.device_scoring is None:
+            self.device_scoring = self._check_device_scoring(observation)
+        if self.device_scoring:
+            return self._deep_svdd_score(observation)
+        return torch.from_numpy(np.asarray(self.clf.decision_function(observation)))
 
-        action = 1 - (score < self.clf.threshold_).astype(int)
-        if 0 not in action and 1 not in action:
-            print("No action is selected as OOD")
-        return action
+    def _deep_svdd_score(self, observation):
+        # same score as pyod's DeepSVDD.decision_function, without the round trip through numpy
+        self.clf.model_.eval()
+        outputs = self.clf.model_(observation)
+        return ((outputs - torch.as_tensor(self.clf.c, device=outputs.device)) ** 2).sum(dim=-1)
+
+    def _check_device_scoring(self, observation):
+        # NOTE: the on-device path is only used if it reproduces decision_function on a batch
+        parts = observation if isinstance(observation, list) else [observation]
+        if not (all(torch.is_tensor(x) for x in parts) and hasattr(self.clf, "model_") and hasattr(self.clf, "c")):
+            return False
+        try:
+            device_score = self._deep_svdd_score(observation).cpu().numpy()
+        except Exception:
+            return False
+        reference = np.asarray(self.clf.decision_function(observation))
+        ok = device_score.shape == reference.shape and np.allclose(device_score, reference, rtol=1e-4, atol=1e-5)
+        logging.info(f"On-device OOD scoring: {'enabled' if ok else 'disabled'}")
+        return ok
+
+    def fit_detector(self, features, features_threshold, num_check_rows=256):
+        """Fits the detector on feature dicts (see gather_rollouts), then checks the on-device DeepSVDD scores."""
+        X, X_threshold = self.select_features(features), self.select_features(features_threshold)
+        if isinstance(self.clf, MahalanobisDetector):
+            # the classes are the greedy actions of the weak agent
+            self.clf.fit(X, X_threshold, labels=features["weak_logit"].argmax(dim=-1))
+        else:
+            self.clf.fit(X, X_threshold)
+        if not isinstance(self.clf, ClosedFormDetector):
+            if isinstance(X_threshold, list):
+                check_obs = [x[:num_check_rows] for x in X_threshold]
+            else:
+                check_obs = X_threshold[:num_check_rows]
+            self.device_scoring = self._check_device_scoring(check_obs)
 
     def initialize_ood_detector(self, args, env):
         if self.args.method == "DeepSVDD":
@@ -176,39 +231,102 @@ class OODPolicy(Policy):
 
             dummy_obs_shape = feature_type_to_shapes[self.feature_type](dummy_obs)
 
-            self.clf_name = 'DeepSVDD'
-            self.clf = deep_svdd.DeepSVDD(
-                n_features=args.feature_size,
-                use_ae=args.use_ae,
-                contamination=args.contamination,
-                epochs=args.epoch,
-                batch_size=args.batch_size,
-                input_shape=dummy_obs_shape,
-                feature_type=self.feature_type,
-                benchmark=get_global_variable("benchmark"),
-            )
+            clf_config = {
+                "n_features": args.feature_size,
+                "use_ae": args.use_ae,
+                "contamination": args.contamination,
+                "epochs": args.epoch,
+                "batch_size": args.batch_size,
+                "input_shape": tuple(int(d) for d in dummy_obs_shape),
+                "feature_type": self.feature_type,
+                "benchmark": get_global_variable("benchmark"),
+            }
+        elif self.args.method == "Mahalanobis":
+            clf_config = {"feature_type": self.feature_type, "contamination": args.contamination}
+        elif self.args.method == "KNN":
+            clf_config = {
+                "feature_type": self.feature_type,
+                "n_neighbors": args.n_neighbors,
+                "contamination": args.contamination,
+            }
+        else:
+            raise ValueError(f"Unknown OOD detector type: {self.args.method}")
+        self._build_detector(self.args.method, clf_config)
+
+    def _build_detector(self, clf_name, clf_config):
+        if clf_name == "DeepSVDD":
+            # NOTE: imported here so that the closed-form detectors work without the pyod submodule
+            from lib.pyod.pyod.models import deep_svdd
+
+            self.clf = deep_svdd.DeepSVDD(**clf_config)
             self.clf.model_.to(self.device)
+        elif clf_name == "Mahalanobis":
+            self.clf = MahalanobisDetector(**clf_config, device=self.device)
+        elif clf_name == "KNN":
+            self.clf = KNNDetector(**clf_config, device=self.device)
         else:
-            raise ValueError(f"Unknown OOD detector type: {args.ood_detector}")
+            raise ValueError(f"Unknown OOD detector type: {clf_name}")
+        self.clf_name = clf_name
+        self.clf_config = clf_config
+        self.device_scoring = None
+
+    def _detector_state_dict(self):
+        if isinstance(self.clf, ClosedFormDetector):
+            return self.clf.state_dict()
+        return {"model": self.clf.model_.state_dict(), "c": torch.as_tensor(self.clf.c)}
+
+    def _load_detector_state_dict(self, state_dict):
+        if isinstance(self.clf, ClosedFormDetector):
+            self.clf.load_state_dict(state_dict)
+        else:
+            self.clf.model_.load_state_dict(state_dict["model"])
+            self.clf.c = state_dict["c"]
 
     def save_model(self, name, save_dir):
-        save_path = os.path.join(save_dir, f"{name}.joblib")
+        save_path = os.path.join(save_dir, f"{name}.ckpt")
+        if not isinstance(self.clf, ClosedFormDetector) and not self.device_scoring:
+            # NOTE: a compact DeepSVDD checkpoint can only be scored on device, which did not reproduce
+            # decision_function, so the whole detector is pickled instead
+            logging.warning("On-device OOD scoring is not verified, saving the whole detector")
+            dump({"clf": self.clf, "clf_name": self.clf_name, "params": self._plain_params()}, save_path)
+            logging.info(f"Saved model to {save_path}")
+            return
+
+        # NOTE: only tensors and plain values are saved (no pickled detector or training scores), so that
+        # checkpoints stay small and load with weights_only and memory-mapped tensors
         state_dict = {
-            'clf': self.clf,
-            'class_name': self.__class__.__name__,
-            'config': {
-                'contamination': self.clf.contamination,
-            },
-            'clf_name': self.clf_name,
+            "class_name": self.__class__.__name__,
+            "clf_name": self.clf_name,
+            "config": self.clf_config,
+            "state_dict": self._detector_state_dict(),
+            "threshold": float(self.clf.threshold_),
+            "params": self._plain_params(),
         }
-        if type(self.clf) == deep_svdd.DeepSVDD:
-            state_dict['config']['use_ae'] = self.clf.use_ae
-        dump(state_dict, save_path)
+        torch.save(state_dict, save_path)
         logging.info(f"Saved model to {save_path}")
 
-    def load_model(self, load_dir):
-        state_dict = load(f"{load_dir}")
-        self.clf = state_dict['clf']
+    def _plain_params(self):
+        # weights_only loading rejects numpy scalars, such as the np.linspace candidate thresholds
+        return {k: np.asarray(v).tolist() for k, v in self.params.items()}
+
+    def load_model(self, load_path):
+        if not zipfile.is_zipfile(load_path):
+            # pickled detectors: .joblib checkpoints saved before the compact format, or unverified DeepSVDD
+            state_dict = load(load_path)
+            self.clf = state_dict["clf"]
+            self.clf_name = state_dict["clf_name"]
+            if "params" in state_dict:
+                self.params = dc(state_dict["params"])
+            self.device_scoring = None
+            return self
+
+        state_dict = torch.load(load_path, map_location=self.device, mmap=True, weights_only=True)
+        self._build_detector(state_dict["clf_name"], state_dict["config"])
+        self._load_detector_state_dict(state_dict["state_dict"])
+        self.params = dc(state_dict["params"])
+        self.clf.threshold_ = state_dict["threshold"]
+        # compact DeepSVDD checkpoints are only saved once the on-device path has been checked
+        self.device_scoring = True
         return self
 
     def to_tensor(self, data):
@@ -222,3 +340,42 @@ class OODPolicy(Policy):
         if not torch.is_tensor(data):
             return torch.from_numpy(data).float().to(self.device)
         return data
+
+
+class SlicedOODPolicy(Policy):
+    """Runs OOD policies side by side (e.g. one per feature type), the i-th one on the i-th contiguous slice of
+    the batch, so that they share the rollouts of a wide env.
+    """
+
+    def __init__(self, policies):
+        self.policies = policies
+
+    def train(self):
+        for policy in self.policies:
+            policy.train()
+
+    def eval(self):
+        for policy in self.policies:
+            policy.eval()
+
+    def act(self, obs, greedy=False):
+        batch_size = self._batch_size(obs)
+        assert batch_size % len(self.policies) == 0
+        slice_size = batch_size // len(self.policies)
+        actions = []
+        for i, policy in enumerate(self.policies):
+            sl = slice(i * slice_size, (i + 1) * slice_size)
+            actions.append(policy.act(self._slice_obs(obs, sl), greedy=greedy))
+        return np.concatenate(actions)
+
+    @classmethod
+    def _batch_size(cls, obs):
+        if isinstance(obs, dict):
+            return cls._batch_size(next(iter(obs.values())))
+        return len(obs)
+
+    @classmethod
+    def _slice_obs(cls, obs, sl):
+        if isinstance(obs, dict):
+            return {k: cls._slice_obs(v, sl) for k, v in obs.items()}
+        return obs[sl]
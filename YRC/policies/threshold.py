@@ -5,8 +5,10 @@ from copy import deepcopy as dc
 import torch
 import logging
 from torch.distributions.categorical import Categorical
-from YRC.core import Policy
+from YRC.core import Policy, feature_store
 from YRC.core.configs.global_configs import get_global_variable
+from YRC.models.utils import THRESHOLD_METRICS, compute_uncertainty_metrics
+from YRC.policies.utils import QuantileSketch
 
 
 class ThresholdPolicy(Policy):
@@ -15,9 +17,17 @@ class ThresholdPolicy(Policy):
         self.agent = env.weak_agent
         self.params = {"threshold": 0.0, "explore_temp": 1.0, "score_temp": 1.0}
         self.device = get_global_variable("device")
+        self.logit_summary = bool(config.coord_env.logit_summary)
+        self.feature_store = feature_store.make(config)
+
+    @classmethod
+    def obs_keys(cls, config):
+        return ["env_obs", "weak_logit"]
 
     def act(self, obs, greedy=False):
-        if get_global_variable("benchmark") == "cliport":
+        if self.logit_summary:
+            score = self._summary_score(obs["weak_logit"])
+        elif get_global_variable("benchmark") == "cliport":
             attention_size = 3  # todo: get this shape automatically
             attention_flat = obs["weak_logit"][:, :attention_size]
             transport_flat = obs["weak_logit"][:, attention_size:]
@@ -27,77 +37,120 @@ class ThresholdPolicy(Policy):
                 transport_flat = torch.from_numpy(transport_flat).float().to(self.device)
             attention_score = self._compute_score(attention_flat)
             transport_score = self._compute_score(transport_flat)
-            score = torch.mean(torch.stack([attention_score, transport_score])).unsqueeze(0)
+            score = torch.stack([attention_score, transport_score]).mean(dim=0)
         else:
             weak_logit = obs["weak_logit"]
             if not torch.is_tensor(weak_logit):
                 weak_logit = torch.from_numpy(weak_logit).float().to(self.device)
             score = self._compute_score(weak_logit)
         # NOTE: higher score = more certain
-        action = (score < self.params["threshold"]).int()
+        action = (score < self._get_threshold(score)).int()
         return action.cpu().numpy()
 
-    def generate_scores(self, env, num_rollouts):
+    def _get_threshold(self, score):
+        threshold = self.params["threshold"]
+        if np.ndim(threshold) == 0:
+            return threshold
+        # NOTE: a list of thresholds is evaluated at once, each one on its own contiguous slice of the batch
+        assert len(score) % len(threshold) == 0
+        threshold = np.repeat(np.asarray(threshold, dtype=np.float32), len(score) // len(threshold))
+        return torch.from_numpy(threshold).to(score.device)
+
+    def generate_scores(self, env, num_rollouts, sketches=None):
+        """Streams the scores of the weak agent on num_rollouts episodes into (mergeable) quantile sketches.
+
+        Every metric of THRESHOLD_METRICS is scored from the same rollouts, one sketch per metric. With a
+        feature store, the logits of the rollouts are saved and later runs score them without simulating.
+        """
         assert num_rollouts % env.num_envs == 0
-        scores = []
-        for i in range(num_rollouts // env.num_envs):
-            scores.extend(self._rollout_once(env))
-        return scores
-
-    def _rollout_once(self, env):
+        if sketches is None:
+            sketches = {metric: QuantileSketch() for metric in THRESHOLD_METRICS}
+
+        # NOTE: threshold entries only store weak_logit, they cannot serve other feature types
+        store_key = {"kind": "threshold", "num_rollouts": num_rollouts, "explore_temp": self.params["explore_temp"]}
+        entry = self.feature_store.load(**store_key) if self.feature_store is not None else None
+        if entry is not None:
+            for chunk in entry.chunks("weak_logit"):
+                self._update_sketches(sketches, torch.from_numpy(np.asarray(chunk)).to(self.device))
+            return sketches
+
+        writer = self.feature_store.writer(**store_key) if self.feature_store is not None else None
+        try:
+            for i in range(num_rollouts // env.num_envs):
+                self._rollout_once(env, sketches, writer)
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        if writer is not None:
+            writer.commit()
+        return sketches
+
+    def _rollout_once(self, env, sketches, writer=None, flush_steps=256):
         def sample_action(logit):
             dist = Categorical(logits=logit / self.params["explore_temp"])
             return dist.sample().cpu().numpy()
 
-        agent = self.agent
-        agent.eval()
+        self.agent.eval()
         obs = env.reset()
         has_done = np.array([False] * env.num_envs)
-        scores = []
+        # NOTE: logits stay on device and are scored and copied every flush_steps steps
+        step_logits, step_active = [], []
 
         while not has_done.all():
-            logit = agent.forward(obs["env_obs"])
-            score = self._compute_score(logit)
-
-            if env.num_envs == 1:
-                scores.append(score.item())
-            else:
-                for i in range(env.num_envs):
-                    if not has_done[i]:
-                        scores.append(score[i].item())
+            # NOTE: CoordEnv already ran the weak agent on this observation
+            logit = obs["weak_logit"]
+            if not torch.is_tensor(logit):
+                logit = torch.from_numpy(logit).float().to(self.device)
+            step_logits.append(logit.detach())
+            step_active.append(~has_done)
+            if len(step_logits) == flush_steps:
+                self._flush_logits(sketches, writer, step_logits, step_active)
 
             action = sample_action(logit)
             obs, reward, done, info = env.step(action)
             has_done |= done
 
-        return scores
+        self._flush_logits(sketches, writer, step_logits, step_active)
+
+    def _flush_logits(self, sketches, writer, step_logits, step_active):
+        if step_logits:
+            # (steps, envs, dim) -> (active samples, dim)
+            logit = torch.stack(step_logits).flatten(0, 1)
+            active = torch.from_numpy(np.stack(step_active).reshape(-1)).to(logit.device)
+            logit = logit[active]
+            self._update_sketches(sketches, logit)
+            if writer is not None:
+                writer.append({"weak_logit": logit.cpu().numpy()})
+            step_logits.clear()
+            step_active.clear()
+
+    def _update_sketches(self, sketches, logit):
+        scores = self._summary_scores(logit) if self.logit_summary else self._compute_scores(logit)
+        scores = scores.cpu().numpy()
+        for i, metric in enumerate(THRESHOLD_METRICS):
+            sketches[metric].update(scores[:, i])
+
+    def _summary_scores(self, summary):
+        # NOTE: summary holds the THRESHOLD_METRICS of each head (attention, transport), computed by the weak agent
+        if not torch.is_tensor(summary):
+            summary = torch.from_numpy(summary).float().to(self.device)
+        return summary.view(summary.shape[0], -1, len(THRESHOLD_METRICS)).mean(dim=1)
+
+    def _summary_score(self, summary):
+        return self._summary_scores(summary)[:, self._metric_index()]
+
+    def _compute_scores(self, logit):
+        # NOTE: all THRESHOLD_METRICS in one pass, higher score = more certain
+        return compute_uncertainty_metrics(logit / self.params["score_temp"])
 
     def _compute_score(self, logit):
-        # NOTE: higher score = more certain
-        metric = self.args.metric
-        logit = logit / self.params["score_temp"]
-        if metric == "max_logit":
-            score = logit.max(dim=-1)[0]
-        elif metric == "max_prob":
-            score = logit.softmax(dim=-1).max(dim=-1)[0]
-        elif metric == "margin":
-            if logit.size(-1) > 1:
-                # Original behavior for multi-class case
-                top2 = logit.softmax(dim=-1).topk(2, dim=-1)[0]
-                if len(top2.shape) == 1:
-                    top2 = top2.unsqueeze(0)
-                score = top2[:, 0] - top2[:, 1]
-            else:
-                # Binary case when logit has shape (..., 1)
-                score = logit.sigmoid().squeeze(-1)
-        elif metric == "neg_entropy":
-            score = -Categorical(logits=logit).entropy()
-        elif metric == "neg_energy":
-            score = logit.logsumexp(dim=-1)
-        else:
-            raise NotImplementedError(f"Unrecognized metric: {metric}")
+        return self._compute_scores(logit)[..., self._metric_index()]
 
-        return score
+    def _metric_index(self):
+        if self.args.metric not in THRESHOLD_METRICS:
+            raise NotImplementedError(f"Unrecognized metric: {self.args.metric}")
+        return THRESHOLD_METRICS.index(self.args.metric)
 
     def update_params(self, params):
         self.params = dc(params)
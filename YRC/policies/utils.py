@@ -0,0 +1,121 @@
+import numpy as np
+import torch
+
+
+class QuantileSketch:
+    """Mergeable streaming quantile sketch (KLL-style compactors) with bounded memory.
+
+    Level i holds items of weight 2**i. When a level reaches capacity, it is sorted and every other item
+    (starting at a random offset) moves up one level. The rank error is O(1/capacity) and memory only grows
+    logarithmically with the number of items. Quantiles are exact as long as nothing has been compacted.
+    """
+
+    def __init__(self, capacity=4096, seed=None):
+        self.capacity = capacity
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.count
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        if values.size == 0:
+            return
+        self.count += values.size
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compact()
+
+    def merge(self, other):
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self._compact()
+        return self
+
+    def _compact(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) >= self.capacity:
+                items = np.sort(items)
+                # an odd item out stays at this level
+                self.levels[level] = items[len(items) - len(items) % 2:]
+                promoted = items[self.rng.integers(2):len(items) - len(items) % 2:2]
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def quantile(self, q):
+        """Returns the q-quantile(s), q in [0, 1], like np.percentile(values, 100 * q)."""
+        if self.count == 0:
+            raise ValueError("Cannot compute quantiles of an empty sketch!")
+        if len(self.levels) == 1:
+            return np.percentile(self.levels[0], np.asarray(q) * 100)
+
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values)
+        values, cum_weights = values[order], np.cumsum(weights[order])
+        ranks = np.asarray(q) * (cum_weights[-1] - 1)
+        indices = np.searchsorted(cum_weights, ranks, side="right")
+        return values[np.minimum(indices, len(values) - 1)]
+
+
+class ReservoirBuffer:
+    """Fixed-capacity uniform sample of feature rows, filled by vectorized reservoir sampling.
+
+    Rows are kept on the CPU, in tensors that grow (by doubling) with the number of rows seen, up to capacity.
+    Rows of a batch are considered one after another (algorithm R), so every row seen has the same chance of
+    being kept.
+    """
+
+    def __init__(self, capacity, seed=None):
+        self.capacity = capacity
+        self.num_seen = 0
+        self.data = {}
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return min(self.num_seen, self.capacity)
+
+    def add(self, batch, mask=None):
+        """Adds the rows of batch (key -> tensor of shape (N, ...)) selected by the boolean numpy mask."""
+        batch_size = len(next(iter(batch.values())))
+        rows = np.arange(batch_size) if mask is None else mask.nonzero()[0]
+        if rows.size == 0:
+            return
+
+        seen = self.num_seen + np.arange(rows.size)
+        slots = np.where(seen < self.capacity, seen, (self.rng.random(rows.size) * (seen + 1)).astype(np.int64))
+        self.num_seen += rows.size
+        keep = slots < self.capacity
+        rows, slots = rows[keep], slots[keep]
+        if rows.size == 0:
+            return
+        # when two rows draw the same slot, the later one wins as in sequential sampling
+        slots, last = np.unique(slots[::-1], return_index=True)
+        rows = rows[::-1][last]
+
+        for key, values in batch.items():
+            # NOTE: only the kept rows are copied off the device
+            values = values[torch.from_numpy(rows).to(values.device)].cpu()
+            self._reserve(key, values, len(self))
+            self.data[key][torch.from_numpy(slots)] = values
+
+    def _reserve(self, key, values, num_rows):
+        data = self.data.get(key)
+        if data is not None and len(data) >= num_rows:
+            return
+        size = min(self.capacity, max(num_rows, 2 * len(data) if data is not None else 0))
+        new_data = torch.empty((size,) + tuple(values.shape[1:]), dtype=values.dtype)
+        if data is not None:
+            new_data[:len(data)] = data
+        self.data[key] = new_data
+
+    def get(self, key):
+        return self.data[key][:len(self)]
@@ -11,10 +11,22 @@ def parse_file(key, file_path):
         for line in file:
             if "Raw Rewards" not in line:
                 continue
+            # rewards recomputed for other query costs (-eval_qcs), used when there is no run for that cost
+            match = re.search(r"Raw Rewards \(qc ([0-9.]+)\):", line)
+            if match is not None:
+                suite, env, method, _, eval_mode = key.split("/")
+                qc_key = "/".join((suite, env, method, str(float(match.group(1))), eval_mode))
+                rewards = [float(value) for value in line[match.end():].split(",") if value.strip()]
+                # keep the rewards of a single source run per cost
+                if multi_cost_source.setdefault(qc_key, key) == key:
+                    multi_cost_result[qc_key].extend(rewards)
+                continue
             rewards = [float(value) for value in line.replace("Raw Rewards:", "").split(",") if value.strip()]
             result[key].extend(rewards)
 
 result = defaultdict(list)
+multi_cost_result = defaultdict(list)
+multi_cost_source = {}
 for suite in ENVS.keys():
     for env in ENVS[suite]:
         for method in METHODS:
@@ -30,6 +42,10 @@ for suite in ENVS.keys():
                                     key = "/".join((suite, env, method, str(qc), eval_mode))
                                     parse_file(key, file_path)
 
+for key, rewards in multi_cost_result.items():
+    if key not in result:
+        result[key] = rewards
+
 with open("./raw_results.json", "w") as f:
     json.dump(result, f, indent=2)
 
@@ -25,6 +25,21 @@ def make():
                         help="Cost of querying strong agent")
     parser.add_argument("-switch_cost", "--coord_env.switch_agent_cost_ratio", type=float,
                         help="Cost of switching agent")
+    parser.add_argument("-obs_device", "--coord_env.obs_on_device", type=int,
+                        help="Keep weak agent features and logits on the model device")
+    parser.add_argument("-pipelined", "--coord_env.pipelined", type=int,
+                        help="Step the environment on worker threads, overlapping the simulation of each sub-batch "
+                             "with weak/strong agent inference on the others (levels differ from unpipelined runs)")
+    parser.add_argument("-pipeline_parts", "--coord_env.pipeline_parts", type=int,
+                        help="Number of sub-batches the environment is split into when pipelined (procgen)")
+    parser.add_argument("-logit_summary", "--coord_env.logit_summary", type=int,
+                        help="Weak agent logits are replaced by per-head threshold metrics (cliport)")
+    parser.add_argument("-calib_cache", "--evaluation.calibration_cache", type=str,
+                        help="path to the cache of strong agent statistics used to set query costs")
+    parser.add_argument("-early_stop", "--evaluation.early_stop", type=int,
+                        help="stop evaluating a sweep candidate once it is clearly worse than the best one")
+    parser.add_argument("-eval_qcs", "--evaluation.cost_ratios", type=float, nargs="+",
+                        help="strong query cost ratios for which evaluation also reports the reward")
     parser.add_argument("-en", "--environment.common.env_name", type=str,
                         help="name of the environment")
     parser.add_argument("-sim", "--agents.sim_weak", type=str,
@@ -42,6 +57,8 @@ def make():
                         help="Type of features for coordination policy")
     parser.add_argument("-cp_data_agent", "--coord_policy.collect_data_agent", type=str, choices=["weak", "strong"], default="weak",
                         help="agent to collect data")
+    parser.add_argument("-feature_store", "--algorithm.feature_store", type=str,
+                        help="directory caching the rollout features of the threshold and ood algorithms")
 
     # always policy
     parser.add_argument("-cp_agent", "--coord_policy.agent", type=str,
@@ -52,11 +69,21 @@ def make():
     parser.add_argument("-cp_metric", "--coord_policy.metric", type=str,
                         choices=["max_logit", "max_prob", "margin", "neg_entropy", "neg_energy"],
                         help="metric for computing scores")
+    parser.add_argument("-search", "--algorithm.search", type=str, choices=["grid", "halving"],
+                        help="threshold search strategy of the threshold and ood algorithms")
+    parser.add_argument("-batch_cands", "--algorithm.batch_candidates", type=int,
+                        help="evaluate candidates side by side in one rollout of a wider env "
+                             "(threshold: all candidate thresholds, ood: the detectors of all feature types)")
 
     # ood policy
     parser.add_argument("-cp_method", "--coord_policy.method", type=str,
-                        choices=["DeepSVDD"],
+                        choices=["DeepSVDD", "Mahalanobis", "KNN"],
                         help="method for detecting OOD samples")
+    parser.add_argument("-ood_features", "--algorithm.feature_types", type=str, nargs="+",
+                        choices=["obs", "hidden", "hidden_obs", "dist", "hidden_dist", "obs_dist", "obs_hidden_dist"],
+                        help="train ood detectors for all these feature types from a single rollout")
+    parser.add_argument("-ood_samples", "--algorithm.num_samples", type=int,
+                        help="number of feature rows sampled to train the ood detector (default per benchmark)")
 
     # random baseline policy
     parser.add_argument("-cp_base", "--coord_policy.baseline", action="store_true",
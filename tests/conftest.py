@@ -0,0 +1,5 @@
+import os
+import sys
+
+# NOTE: YRC is not installed as a package, the tests import it from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
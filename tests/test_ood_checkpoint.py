@@ -0,0 +1,91 @@
+import zipfile
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+
+from YRC.core.configs.config import ConfigDict
+from YRC.core.configs.global_configs import set_global_variable
+from YRC.policies.ood import OODPolicy, SlicedOODPolicy
+
+NUM_FEATURES = 16
+
+
+class FakeEnv:
+    weak_agent = None
+
+    def reset(self):
+        return {"weak_features": np.zeros((4, NUM_FEATURES), dtype=np.float32)}
+
+
+def make_features(num_rows):
+    return {"weak_features": torch.randn(num_rows, NUM_FEATURES), "weak_logit": torch.randn(num_rows, 4)}
+
+
+def make_policy(method):
+    config = ConfigDict(
+        coord_policy={
+            "collect_data_agent": "weak",
+            "feature_type": "hidden",
+            "method": method,
+            "feature_size": 8,
+            "use_ae": False,
+            "contamination": 0.1,
+            "epoch": 1,
+            "batch_size": 32,
+            "n_neighbors": 3,
+        },
+        algorithm={"feature_store": None},
+    )
+    return OODPolicy(config, FakeEnv())
+
+
+@pytest.mark.parametrize("method", ["DeepSVDD", "Mahalanobis", "KNN"])
+def test_save_load_round_trip(method, tmp_path):
+    if method == "DeepSVDD":
+        pytest.importorskip("lib.pyod.pyod.models.deep_svdd")
+    set_global_variable("device", torch.device("cpu"))
+    set_global_variable("benchmark", "procgen")
+    torch.manual_seed(0)
+
+    policy = make_policy(method)
+    policy.initialize_ood_detector(policy.args, FakeEnv())
+    policy.fit_detector(make_features(256), make_features(128))
+    scores = policy.clf.decision_scores_
+    # candidate thresholds of the grid search are numpy scalars
+    threshold = np.linspace(scores.min(), scores.max(), 5)[2]
+    policy.update_params({"threshold": threshold, "explore_temp": 1.0})
+    policy.save_model("best_val_sim", str(tmp_path))
+
+    save_path = tmp_path / "best_val_sim.ckpt"
+    if method != "DeepSVDD":
+        assert zipfile.is_zipfile(save_path)
+    loaded = make_policy(method).load_model(str(save_path))
+
+    assert loaded.params == {"threshold": float(threshold), "explore_temp": 1.0}
+    assert float(loaded.clf.threshold_) == pytest.approx(float(threshold))
+    obs = {"weak_features": torch.randn(64, NUM_FEATURES)}
+    np.testing.assert_array_equal(policy.act(obs), loaded.act(obs))
+
+
+def test_sliced_policy_acts_per_slice():
+    set_global_variable("device", torch.device("cpu"))
+    set_global_variable("benchmark", "procgen")
+    torch.manual_seed(0)
+
+    policies = []
+    for method in ["Mahalanobis", "KNN"]:
+        policy = make_policy(method)
+        policy.initialize_ood_detector(policy.args, FakeEnv())
+        policy.fit_detector(make_features(256), make_features(128))
+        policy.update_params({"threshold": float(np.median(policy.clf.decision_scores_))})
+        policies.append(policy)
+
+    obs = make_features(2 * 32)
+    action = SlicedOODPolicy(policies).act(obs)
+
+    assert action.shape == (2 * 32,)
+    for i, policy in enumerate(policies):
+        sl = slice(i * 32, (i + 1) * 32)
+        np.testing.assert_array_equal(action[sl], policy.act({k: v[sl] for k, v in obs.items()}))
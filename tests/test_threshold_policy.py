@@ -0,0 +1,43 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+
+from YRC.algorithms.threshold import ThresholdAlgorithm
+from YRC.core.configs.config import ConfigDict
+from YRC.core.configs.global_configs import set_global_variable
+from YRC.policies.threshold import ThresholdPolicy
+
+
+class FakeEnv:
+    weak_agent = None
+
+
+def make_policy():
+    config = ConfigDict(
+        coord_policy={"metric": "max_prob"},
+        coord_env={"logit_summary": False},
+        algorithm={"feature_store": None},
+    )
+    return ThresholdPolicy(config, FakeEnv())
+
+
+def test_act_with_batched_thresholds():
+    set_global_variable("device", torch.device("cpu"))
+    set_global_variable("benchmark", "procgen")
+    torch.manual_seed(0)
+
+    policy = make_policy()
+    thresholds = [0.0, 0.3, 0.6, 1.1]
+    cand_params = [ThresholdAlgorithm._make_params(threshold) for threshold in thresholds]
+    batched_params = dict(cand_params[0], threshold=[params["threshold"] for params in cand_params])
+    policy.update_params(batched_params)
+
+    # one slice of 8 envs per candidate, as in the wide envs of a batched sweep
+    obs = {"weak_logit": torch.randn(len(thresholds) * 8, 4)}
+    action = policy.act(obs)
+
+    assert action.shape == (len(thresholds) * 8,)
+    for i, params in enumerate(cand_params):
+        policy.update_params(params)
+        np.testing.assert_array_equal(action[i * 8:(i + 1) * 8], policy.act(obs)[i * 8:(i + 1) * 8])
@@ -17,6 +17,10 @@ if __name__ == "__main__":
         evaluator.eval(policy, envs, ["val_sim", "val_true"])
     else:
         algorithm = algo_factory.make(config, envs["train"])
+        if algorithm.num_eval_slices > 1:
+            # policies evaluated side by side each get their own slice of a wider env, in a single rollout
+            wide_envs = env_factory.make_wide_envs(config, envs, ["val_sim", "val_true"], algorithm.num_eval_slices)
+            envs.update({f"{name}_wide": env for name, env in wide_envs.items()})
         algorithm.train(
             policy,
             envs,